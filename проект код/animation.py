@@ -0,0 +1,103 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from figure_builder import build_solid, cached_render, release_figure, render_cache
+from render_cache import make_key
+from solid_geometry import ConvexPolyhedron, canonical_plane, make_solid, point
+
+
+def sweep_sections(solid: ConvexPolyhedron, normal, frames: int) -> List[np.ndarray]:
+    normal = np.asarray(normal, dtype=float)
+    normal = normal / np.linalg.norm(normal)
+    heights = solid.get_vertices() @ normal
+    # крайние положения плоскости касаются фигуры в вершине или грани, их отбрасываем
+    offsets = np.linspace(heights.min(), heights.max(), frames + 2)[1:-1]
+    planes = np.column_stack([np.tile(normal, (frames, 1)), -offsets])
+
+    batch = solid.intersect_planes_with_edges(planes)
+    return [batch.section(i) for i in range(frames)]
+
+
+def render_frames(solid: ConvexPolyhedron, sections: List[np.ndarray]) -> List[np.ndarray]:
+    from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+
+    ax, fig = build_solid(solid)
+    section = Poly3DCollection([], facecolors='red', edgecolors='r', alpha=0.4, animated=True)
+    ax.add_collection3d(section, autolim=False)
+
+    # фигура рисуется один раз, дальше каждый кадр - это фон плюс перерисованный многоугольник сечения
+    canvas = fig.canvas
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+
+    frames = []
+    for polygon in sections:
+        canvas.restore_region(background)
+        section.set_verts([polygon] if len(polygon) >= 3 else [])
+        section.do_3d_projection()
+        ax.draw_artist(section)
+        frames.append(np.asarray(canvas.buffer_rgba())[:, :, :3].copy())
+
+    release_figure(fig)
+    return frames
+
+
+def encode_gif(frames: List[np.ndarray], fps: int) -> bytes:
+    # одна палитра на все кадры (по первому, среднему и последнему кадру, чтобы в неё попал цвет сечения),
+    # так что квантование каждого кадра обходится дёшево
+    palette = Image.fromarray(np.concatenate([frames[0], frames[len(frames) // 2], frames[-1]])).quantize(colors=64)
+    images = [Image.fromarray(frame).quantize(palette=palette, dither=Image.Dither.NONE) for frame in frames]
+    buf = BytesIO()
+    images[0].save(buf, format='GIF', save_all=True, append_images=images[1:],
+                   duration=int(1000 / fps), loop=0, optimize=False)
+    return buf.getvalue()
+
+
+def encode_mp4(frames: List[np.ndarray], fps: int) -> bytes:
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise ValueError("Для MP4 нужен ffmpeg")
+    height, width, _ = frames[0].shape
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sweep.mp4")
+        subprocess.run([ffmpeg, "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24",
+                        "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+                        "-pix_fmt", "yuv420p", "-movflags", "+faststart", path],
+                       input=b"".join(frame.tobytes() for frame in frames), check=True)
+        with open(path, 'rb') as file:
+            return file.read()
+
+
+def draw_sweep(kind: str, dimensions: Tuple[float, ...], normal: Tuple[float, float, float],
+               frames: int = 60, fps: int = 20, fmt: str = "gif") -> bytes:
+    solid = make_solid(kind, tuple(dimensions))
+    images = render_frames(solid, sweep_sections(solid, normal, frames))
+    if fmt == "mp4":
+        return encode_mp4(images, fps)
+    return encode_gif(images, fps)
+
+
+def sweep_key(kind: str, dimensions: Tuple[float, ...], normal: Tuple[float, ...], frames: int, fps: int,
+              fmt: str) -> str:
+    return make_key("sweep", kind, *dimensions, normal, frames, fps, fmt)
+
+
+def render_sweep(kind: str, dimensions: Tuple[float, ...], point_1: point, point_2: point, point_3: point,
+                 frames: int = 60, fps: int = 20, fmt: str = "gif") -> bytes:
+    # плоскость движется вдоль канонической нормали, поэтому разные тройки точек одной плоскости дают одну анимацию
+    normal = canonical_plane(point_1, point_2, point_3)[:3]
+    key = sweep_key(kind, dimensions, normal, frames, fps, fmt)
+    return cached_render(key, draw_sweep, kind, tuple(dimensions), normal, frames, fps, fmt)
+
+
+def lookup_sweep(kind: str, dimensions: Tuple[float, ...], point_1: point, point_2: point, point_3: point,
+                 frames: int = 60, fps: int = 20, fmt: str = "gif") -> Optional[bytes]:
+    normal = canonical_plane(point_1, point_2, point_3)[:3]
+    return render_cache.peek(sweep_key(kind, dimensions, normal, frames, fps, fmt))
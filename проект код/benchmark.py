@@ -0,0 +1,270 @@
+import argparse
+import asyncio
+import fnmatch
+import itertools
+import json
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import config
+
+# бенчмарк работает без Telegram: рендер в том же процессе, хранилища в памяти, методы бота подменены
+config.TOKEN = "0:benchmark"
+config.RENDER_WORKERS = 0
+config.FILE_ID_DB = ":memory:"
+config.STATE_STORAGE = "memory"
+config.METRICS_ENABLED = False
+
+import numpy as np
+
+import figure_builder
+import pillow_renderer
+from solid_geometry import PointsConverter, Parallelepiped, solid_types
+
+point_1, point_2, point_3 = [0.0, 0.0, 0.5], [1.0, 0.0, 0.7], [0.0, 1.0, 0.9]
+
+dialog_inputs = {
+    "tetrahedron": ("Тетраэдр", ["2"]),
+    "parallelepiped": ("Параллелепипед", ["1", "2", "3"]),
+    "octahedron": ("Октаэдр", ["2"]),
+    "pyramid": ("Пирамида", ["2", "3"]),
+    "prism": ("Призма", ["2", "3"]),
+}
+
+
+class Case(NamedTuple):
+    name: str
+    run: Callable[[], object]
+    number: int
+
+
+def geometry_cases() -> List[Case]:
+    cases = [Case("geometry.plane_coefficients", lambda: PointsConverter(point_1, point_2, point_3)
+                  .plane_coefficients(), 2000)]
+    planes = np.random.default_rng(0).random((10000, 3, 3)) * 2
+    for kind, dimensions in (("tetrahedron", (2.0,)), ("parallelepiped", (1.0, 2.0, 3.0))):
+        solid = solid_types[kind](*dimensions)
+        cases += [
+            Case(f"geometry.intersect_plane_with_edges.{kind}",
+                 lambda solid=solid: solid.intersect_plane_with_edges(point_1, point_2, point_3), 2000),
+            Case(f"geometry.section_polygon.{kind}",
+                 lambda solid=solid: solid.section_polygon(point_1, point_2, point_3), 2000),
+            Case(f"geometry.intersect_planes_with_edges.{kind}.10000",
+                 lambda solid=solid: solid.intersect_planes_with_edges(planes), 5),
+        ]
+    return cases
+
+
+def figure_cases() -> List[Case]:
+    builders = {
+        "build_tetrahedron": lambda: figure_builder.build_tetrahedron(2.0)[2],
+        "build_section_tetrahedron": lambda: figure_builder.build_section_tetrahedron(2.0, point_1, point_2,
+                                                                                     point_3)[0],
+        "build_parallelepiped": lambda: figure_builder.build_parallelepiped(1.0, 2.0, 3.0)[2],
+        "build_section_parallelepiped": lambda: figure_builder.build_section_parallelepiped(
+            1.0, 2.0, 3.0, point_1, point_2, point_3)[0],
+    }
+    cases = []
+    for name, build in builders.items():
+        def render(build=build):
+            fig = build()
+            fig.canvas.draw()
+            figure_builder.release_figure(fig)
+
+        def encode(fig=build()):
+            # один раз нарисованная фигура, замеряется только кодирование
+            if fig.stale:
+                fig.canvas.draw()
+            return figure_builder.figure_to_bytes(fig)
+
+        cases += [Case(f"render.{name}", render, 5), Case(f"encode.{name}", encode, 10)]
+
+    solid = Parallelepiped(1.0, 2.0, 3.0)
+    section = solid.section_polygon(point_1, point_2, point_3)
+    image = pillow_renderer.draw_scene(solid, section)
+    cases += [
+        Case("render.pillow.draw_scene", lambda: pillow_renderer.draw_scene(solid, section), 10),
+        Case("encode.pillow.image_to_bytes", lambda: pillow_renderer.image_to_bytes(image), 10),
+    ]
+    return cases
+
+
+class MockBot:
+    # подменяет сетевые методы AsyncTeleBot и отвечает так, как ответил бы Telegram
+    def __init__(self, bot):
+        from telebot import types
+        self.types = types
+        self.ids = itertools.count(1)
+        self.sent = 0
+        for method in ("send_message", "send_photo", "send_document", "send_animation", "answer_callback_query"):
+            setattr(bot, method, getattr(self, method))
+
+    def message(self, chat_id: int, content_type: str = "text"):
+        return self.types.Message(next(self.ids), None, 0, self.types.Chat(chat_id, "private"), content_type, {}, "")
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.sent += 1
+        return self.message(chat_id)
+
+    async def send_photo(self, chat_id: int, photo, **kwargs):
+        self.sent += 1
+        msg = self.message(chat_id, "photo")
+        msg.photo = [self.types.PhotoSize(f"photo-{next(self.ids)}", "unique", 640, 480)]
+        return msg
+
+    async def send_document(self, chat_id: int, document, **kwargs):
+        self.sent += 1
+        return self.message(chat_id, "document")
+
+    async def send_animation(self, chat_id: int, animation, **kwargs):
+        self.sent += 1
+        return self.message(chat_id, "animation")
+
+    async def answer_callback_query(self, callback_query_id, **kwargs):
+        return True
+
+    def update(self, chat_id: int, text: str):
+        return self.types.Update.de_json({
+            "update_id": next(self.ids),
+            "message": {"message_id": next(self.ids), "date": 0, "text": text,
+                        "chat": {"id": chat_id, "type": "private"},
+                        "from": {"id": chat_id, "is_bot": False, "first_name": "benchmark"}},
+        })
+
+
+def dialog_cases() -> List[Case]:
+    import bot
+
+    mock = MockBot(bot.bot)
+    chat_ids = itertools.count(1)
+
+    def conversation(kind: str, cold: bool) -> None:
+        if cold:
+            figure_builder.render_cache.clear()
+        chat_id = next(chat_ids)
+        name, dimensions = dialog_inputs[kind]
+        texts = ["/start", name, *dimensions, *(" ".join(map(str, p)) for p in (point_1, point_2, point_3))]
+
+        async def talk():
+            for text in texts:
+                await bot.bot.process_new_updates([mock.update(chat_id, text)])
+
+        asyncio.run(talk())
+
+    cases = []
+    for kind in dialog_inputs:
+        cases += [
+            Case(f"dialog.{kind}.cold", lambda kind=kind: conversation(kind, True), 2),
+            Case(f"dialog.{kind}.cached", lambda kind=kind: conversation(kind, False), 20),
+        ]
+    return cases
+
+
+suites = {"geometry": geometry_cases, "figure": figure_cases, "dialog": dialog_cases}
+
+
+def measure(case: Case, rounds: int) -> Dict[str, float]:
+    case.run()
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(case.number):
+            case.run()
+        timings.append((time.perf_counter() - start) / case.number)
+    return {
+        "median": statistics.median(timings),
+        "min": min(timings),
+        "mean": statistics.fmean(timings),
+        "rounds": rounds,
+        "number": case.number,
+    }
+
+
+def environment() -> dict:
+    import matplotlib
+    import PIL
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "matplotlib": matplotlib.__version__,
+        "pillow": PIL.__version__,
+        "render_backend": config.RENDER_BACKEND,
+        "image_format": config.IMAGE_FORMAT,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def threshold_for(name: str, default: float, overrides: Dict[str, float]) -> float:
+    for pattern, value in overrides.items():
+        if fnmatch.fnmatch(name, pattern):
+            return value
+    return default
+
+
+def compare(results: dict, baseline: dict, default: float, overrides: Dict[str, float]) -> List[str]:
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:60} {current['min'] * 1000:10.3f} ms   (нет в базовой линии)")
+            continue
+        # сравниваем лучшие раунды: минимум меньше всего зависит от фонового шума машины
+        ratio = current["min"] / previous["min"]
+        threshold = threshold_for(name, default, overrides)
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:60} {current['min'] * 1000:10.3f} ms  {previous['min'] * 1000:10.3f} ms  "
+              f"{ratio:6.2f}x{'  РЕГРЕССИЯ' if regressed else ''}")
+    return regressions
+
+
+def parse_threshold(text: str):
+    pattern, _, value = text.rpartition("=")
+    if not pattern:
+        raise argparse.ArgumentTypeError("порог задаётся как ШАБЛОН=ДОЛЯ, например 'render.*=0.5'")
+    return pattern, float(value)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарки геометрии, рендера, кодирования и диалога бота")
+    parser.add_argument("--suite", action="append", choices=sorted(suites), help="по умолчанию все")
+    parser.add_argument("-k", "--filter", default="*", help="шаблон имени кейса, например 'geometry.*'")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("-o", "--output", help="куда сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON с прошлым запуском для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="допустимый рост лучшего времени, доля от базовой линии")
+    parser.add_argument("--case-threshold", type=parse_threshold, action="append", default=[],
+                        help="порог для кейсов по шаблону: 'dialog.*=0.5'")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for suite in args.suite or suites:
+        for case in suites[suite]():
+            if not fnmatch.fnmatch(case.name, args.filter):
+                continue
+            results[case.name] = measure(case, args.rounds)
+            if not args.baseline:
+                print(f"{case.name:60} {results[case.name]['min'] * 1000:10.3f} ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"environment": environment(), "results": results}, file, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.threshold, dict(args.case_threshold))
+        if regressions:
+            print(f"Регрессий: {len(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
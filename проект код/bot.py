@@ -1,375 +1,329 @@
-import telebot
-from telebot import types
-from config import TOKEN
+import asyncio
+from telebot import types, util
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from config import (TOKEN, FILE_ID_DB, API_URL, API_CONNECTIONS, API_KEEPALIVE, API_RETRIES, API_BACKOFF,
+                    API_MAX_RETRY_AFTER,
+                    RENDER_WORKERS, RENDER_QUEUE_SIZE, RENDER_TIMEOUT, RENDER_START_METHOD, RENDER_WARM_UP,
+                    RENDER_RECYCLE_AFTER, RENDER_MAX_WORKER_RSS, CHAT_RENDER_RATE, CHAT_RENDER_BURST,
+                    CHAT_MAX_PENDING, MEMORY_TRACE_FRAMES, MEMORY_TRACE_TOP,
+                    STATE_STORAGE, STATE_DB, STATE_TTL, STATE_MAX_CHATS, SECTION_VIEWS)
 import keyboards.auxiliary_keyboards as auxiliary_kb
 import keyboards.public_keyboards as public_kb
 
-from figure_builder import (build_tetrahedron, build_section_tetrahedron,
-                            build_parallelepiped, build_section_parallelepiped,
-                            figure_to_bytes)
-from solid_geometry import point, is_positive_number, is_correct_coordinates, are_points_collinear
+from io import BytesIO
+from typing import Awaitable, Callable, NamedTuple, Optional, Tuple
 
-bot = telebot.TeleBot(token=TOKEN)
+import bot_api
+import memory
+import metrics
+from animation import render_sweep, lookup_sweep
+from figure_builder import (render_cache, render_solid, render_section, render_section_view, lookup_solid,
+                            lookup_section, lookup_section_view, set_render_runner)
+from render_service import RenderService, RenderBusy, RenderTimeout
+from render_scheduler import RenderScheduler, RenderSuperseded
+from solid_geometry import (is_positive_number, is_correct_coordinates, are_points_collinear,
+                            geometry_cache_stats)
+from file_id_store import FileIdStore
+from image_encoding import encode_stats, file_name, is_svg
+from chat_state import ChatState, make_storage
+
+if API_URL:
+    asyncio_helper.API_URL = API_URL
+bot_api.install(API_CONNECTIONS, API_KEEPALIVE, API_RETRIES, API_BACKOFF, API_MAX_RETRY_AFTER)
+
+bot = AsyncTeleBot(token=TOKEN)
+file_ids = FileIdStore(FILE_ID_DB)
+states = make_storage(STATE_STORAGE, STATE_DB, STATE_TTL, STATE_MAX_CHATS)
+render_service = RenderService(RENDER_WORKERS, RENDER_QUEUE_SIZE, RENDER_TIMEOUT, RENDER_START_METHOD,
+                               RENDER_WARM_UP, RENDER_RECYCLE_AFTER, RENDER_MAX_WORKER_RSS)
+if RENDER_WORKERS > 0:
+    set_render_runner(render_service.run)
+# не больше рендеров одновременно, чем воркеров: остальные ждут своей очереди по кругу между чатами
+scheduler = RenderScheduler(max(RENDER_WORKERS, 1), CHAT_RENDER_RATE, CHAT_RENDER_BURST, CHAT_MAX_PENDING,
+                            RENDER_QUEUE_SIZE)
+
+metrics.register("geometry_cache", geometry_cache_stats)
+metrics.register("render_cache", render_cache.stats)
+metrics.register("file_ids", file_ids.stats)
+metrics.register("render_service", render_service.stats)
+metrics.register("scheduler", scheduler.stats)
+metrics.register("encode", encode_stats.stats)
+metrics.register("bot_api", lambda: {**asyncio_helper.session_manager.stats(), **bot_api.retry_stats.stats()})
+memory_snapshots = memory.Snapshots(MEMORY_TRACE_FRAMES, MEMORY_TRACE_TOP)
+metrics.register("memory", lambda: {"rss": memory.rss(), "figures": memory.live_figures(),
+                                    **memory_snapshots.stats()})
+metrics.register("states", lambda: {"chats": len(states), "evictions": states.evictions})
+
+
+def recycle_workers() -> str:
+    if render_service.workers == 0:
+        return "Рендер идёт в процессе бота, перезапускать нечего\n"
+    render_service.recycle()
+    return "Пул рендера перезапущен\n"
+
+
+# снимки показывают выделения памяти процесса бота; воркеры рендера лечатся перезапуском
+metrics.add_action("/memory/snapshot", memory_snapshots.snapshot)
+metrics.add_action("/memory/stop", memory_snapshots.stop)
+metrics.add_action("/memory/recycle", recycle_workers)
 
 main_text = "Выбери фигуру, для которой нужно построить сечение."
+busy_text = "Сервер сейчас перегружен. Отправьте это сообщение ещё раз чуть позже."
+timeout_text = "Не удалось построить изображение за отведённое время. Попробуйте ещё раз."
 
 
-@bot.message_handler(commands=['start'])
-def start(message: types.Message) -> None:
-    bot.send_message(chat_id=message.chat.id, text=main_text,
-                     reply_markup=public_kb.select_figure())
+class Dialog(NamedTuple):
+    kind: str
+    prompts: Tuple[str, ...]
+    ready_text: str
+    genitive: str
+    section_ready_text: str
+    # для /section: короткие имена фигуры и названия размеров в том же порядке, что и prompts
+    aliases: Tuple[str, ...]
+    dimension_names: Tuple[str, ...]
 
 
-@bot.message_handler(content_types=['text'])
-def get_figure_name(message: types.Message) -> None:
-    if message.text == "Тетраэдр":
-        msg = bot.send_message(chat_id=message.chat.id, text="Укажи коэффициент для построения правильного тетраэдра.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_coefficient_of_tetrahedron)
-    elif message.text == "Параллелепипед":
-        msg = bot.send_message(chat_id=message.chat.id, text="Укажи длину для построения параллелепипеда.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_length_of_parallelepiped)
+dialogs = {
+    "Тетраэдр": Dialog("tetrahedron",
+                       ("Укажи коэффициент для построения правильного тетраэдра.",),
+                       "Правильный тетраэдр с коэффициентом {0} готов.",
+                       "тетраэдра",
+                       "Тетраэдр с заданным сечением готов.",
+                       ("tetra", "tetrahedron", "тетраэдр"),
+                       ("коэффициент",)),
+    "Параллелепипед": Dialog("parallelepiped",
+                             ("Укажи длину для построения параллелепипеда.",
+                              "Укажите ширину для построения параллелепипеда.",
+                              "Укажите высоту для построения параллелепипеда."),
+                             "Параллелепипед с длинной {0}, шириной {1} и высотой {2} готов.",
+                             "параллелепипеда",
+                             "Параллелепипед с заданным сечением готов.",
+                             ("box", "parallelepiped", "параллелепипед"),
+                             ("длина", "ширина", "высота")),
+    "Октаэдр": Dialog("octahedron",
+                      ("Укажи длину ребра для построения правильного октаэдра.",),
+                      "Правильный октаэдр с ребром {0} готов.",
+                      "октаэдра",
+                      "Октаэдр с заданным сечением готов.",
+                      ("octa", "octahedron", "октаэдр"),
+                      ("ребро",)),
+    "Пирамида": Dialog("pyramid",
+                       ("Укажи сторону основания правильной четырёхугольной пирамиды.",
+                        "Укажите высоту пирамиды."),
+                       "Правильная четырёхугольная пирамида со стороной основания {0} и высотой {1} готова.",
+                       "пирамиды",
+                       "Пирамида с заданным сечением готова.",
+                       ("pyramid", "пирамида"),
+                       ("сторона основания", "высота")),
+    "Призма": Dialog("prism",
+                     ("Укажи сторону основания правильной треугольной призмы.",
+                      "Укажите высоту призмы."),
+                     "Правильная треугольная призма со стороной основания {0} и высотой {1} готова.",
+                     "призмы",
+                     "Призма с заданным сечением готова.",
+                     ("prism", "призма"),
+                     ("сторона основания", "высота")),
+}
 
+dialogs_by_kind = {dialog.kind: dialog for dialog in dialogs.values()}
+dialogs_by_alias = {alias: dialog for dialog in dialogs.values() for alias in dialog.aliases}
 
-# tetrahedron
-def get_coefficient_of_tetrahedron(message: types.Message) -> None:
-    if message.content_type != "text":
-        msg = bot.send_message(chat_id=message.chat.id, text="Вы можете указать только текст. "
-                                                             "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_coefficient_of_tetrahedron)
-        return
-    if message.text == "Отмена":
-        bot.send_message(chat_id=message.chat.id, text=main_text,
-                         reply_markup=public_kb.select_figure())
-        return
-    if not is_positive_number(message.text):
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Вы можете указать только целое или дробное число больше 0. "
-                                    "Попробуйте ещё раз.")
-        bot.register_next_step_handler(msg, get_coefficient_of_tetrahedron)
-        return
-    coefficient = float(message.text)
-    t, ax, fig = build_tetrahedron(coefficient)
-    photo = figure_to_bytes(fig)
-    msg = bot.send_photo(chat_id=message.chat.id, photo=photo,
-                         caption=f"Правильный тетраэдр с коэффициентом {coefficient} готов.\n"
-                                 "Укажите через пробел координаты перовой точки для построения сечения тетраэдра.\n"
-                                 "Пример координат выглядит так (X Y Z).",
-                         reply_markup=auxiliary_kb.cancel_kb())
-    bot.register_next_step_handler(msg, get_first_point_tetrahedron_section, coefficient)
-
-
-def get_first_point_tetrahedron_section(message: types.Message, coefficient: float) -> None:
-    if message.content_type != "text":
-        msg = bot.send_message(chat_id=message.chat.id, text="Вы можете указать только текст. "
-                                                             "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_first_point_tetrahedron_section, coefficient)
-        return
-    if message.text == "Отмена":
-        bot.send_message(chat_id=message.chat.id, text=main_text,
-                         reply_markup=public_kb.select_figure())
-        return
-    if not is_correct_coordinates(message.text):
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Вы можете указать только 3 целых или дробных числа через пробел. "
-                                    "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_first_point_tetrahedron_section, coefficient)
-        return
-    point_1 = list(map(float, message.text.split()))
-    point_1[0], point_1[1] = point_1[1], point_1[0]
-    msg = bot.send_message(chat_id=message.chat.id,
-                           text="Укажите через пробел координаты второй точки для построения сечения тетраэдра.\n"
-                                "Пример координат выглядит так (X Y Z).")
-    bot.register_next_step_handler(msg, get_second_point_tetrahedron_section, coefficient, point_1)
+point_ordinals = ("перовой", "второй", "третей")
 
+only_text = "Вы можете указать только текст. Попробуйте ещё раз."
+yes_text = "Да ✅"
+no_text = "Нет ❌"
 
-def get_second_point_tetrahedron_section(message: types.Message, coefficient: float, point_1: point) -> None:
-    if message.content_type != "text":
-        msg = bot.send_message(chat_id=message.chat.id, text="Вы можете указать только текст. "
-                                                             "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_second_point_tetrahedron_section, coefficient, point_1)
-        return
-    if message.text == "Отмена":
-        bot.send_message(chat_id=message.chat.id, text=main_text,
-                         reply_markup=public_kb.select_figure())
-        return
-    if not is_correct_coordinates(message.text):
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Вы можете указать только 3 целых или дробных числа через пробел. "
-                                    "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_second_point_tetrahedron_section, coefficient, point_1)
-        return
-    point_2 = list(map(float, message.text.split()))
-    point_2[0], point_2[1] = point_2[1], point_2[0]
-    if point_1 == point_2:
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Координаты этой точки совпадают с координатами предыдущей. "
-                                    "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_second_point_tetrahedron_section, coefficient, point_1)
-        return
-    msg = bot.send_message(chat_id=message.chat.id,
-                           text="Укажите через пробел координаты третей точки для построения сечения тетраэдра.\n"
-                                "Пример координат выглядит так (X Y Z).")
-    bot.register_next_step_handler(msg, get_third_point_tetrahedron_section, coefficient, point_1, point_2)
 
+def point_prompt(dialog: Dialog, index: int) -> str:
+    return (f"Укажите через пробел координаты {point_ordinals[index]} точки для построения сечения "
+            f"{dialog.genitive}.\n"
+            "Пример координат выглядит так (X Y Z).")
 
-def get_third_point_tetrahedron_section(message: types.Message, coefficient: float,
-                                        point_1: point, point_2: point) -> None:
-    if message.content_type != "text":
-        msg = bot.send_message(chat_id=message.chat.id, text="Вы можете указать только текст. "
-                                                             "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_third_point_tetrahedron_section, coefficient, point_1, point_2)
-        return
-    if message.text == "Отмена":
-        bot.send_message(chat_id=message.chat.id, text=main_text,
-                         reply_markup=public_kb.select_figure())
-        return
-    if not is_correct_coordinates(message.text):
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Вы можете указать только 3 целых или дробных числа через пробел. "
-                                    "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_third_point_tetrahedron_section, coefficient, point_1, point_2)
-        return
-    point_3 = list(map(float, message.text.split()))
-    point_3[0], point_3[1] = point_3[1], point_3[0]
-    if point_1 == point_3 or point_2 == point_3:
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Координаты этой точки совпадают с координатами предыдущей. "
-                                    "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_third_point_tetrahedron_section, coefficient, point_1, point_2)
-        return
+
+def parse_point(text: str) -> list:
+    new_point = list(map(float, text.split()))
+    new_point[0], new_point[1] = new_point[1], new_point[0]
+    return new_point
+
+
+section_usage = ("Сечение можно построить одним сообщением: фигура с размерами и три точки через «|».\n"
+                 "/section tetra 2 | 0 0 0.5 | 1 0 0.5 | 0 1 0.7\n"
+                 "/section box 3 2 1 | 0 0 0.5 | 1 0 0.7 | 0 1 0.9\n"
+                 "Фигуры: " + "; ".join(f"{dialog.aliases[0]} ({', '.join(dialog.dimension_names)})"
+                                        for dialog in dialogs.values()) + ".")
+
+
+class SectionCommand(NamedTuple):
+    dialog: Dialog
+    dimensions: Tuple[float, ...]
+    points: Tuple[list, ...]
+
+
+def parse_section_command(arguments: str) -> SectionCommand:
+    # ошибки описывают конкретное поле, текст ValueError сразу уходит пользователю
+    parts = [part.strip() for part in arguments.split("|")]
+    if len(parts) != 4:
+        raise ValueError(f"Нужно 4 части через «|»: фигура с размерами и три точки, а указано {len(parts)}.")
+    if not parts[0]:
+        raise ValueError("Фигура не указана: первая часть - название фигуры и её размеры, например «box 3 2 1».")
+    name, *dimensions = parts[0].split()
+    dialog = dialogs_by_alias.get(name.lower())
+    if dialog is None:
+        raise ValueError(f"Неизвестная фигура «{name}». Доступны: "
+                         f"{', '.join(dialog.aliases[0] for dialog in dialogs.values())}.")
+    if len(dimensions) != len(dialog.dimension_names):
+        raise ValueError(f"Для {dialog.genitive} нужно указать {len(dialog.dimension_names)} "
+                         f"({', '.join(dialog.dimension_names)}), а указано {len(dimensions)}.")
+    for dimension_name, value in zip(dialog.dimension_names, dimensions):
+        if not is_positive_number(value):
+            raise ValueError(f"{dimension_name.capitalize()} «{value}»: нужно целое или дробное число больше 0.")
+
+    points = []
+    for i, text in enumerate(parts[1:], 1):
+        try:
+            new_point = parse_point(text) if is_correct_coordinates(text) else None
+        except ValueError:
+            new_point = None
+        if new_point is None:
+            raise ValueError(f"Точка {i} «{text}»: нужно 3 целых или дробных числа через пробел.")
+        if new_point in points:
+            raise ValueError(f"Точка {i} совпадает с точкой {points.index(new_point) + 1}.")
+        points.append(new_point)
     # noinspection PyTypeChecker
-    if are_points_collinear(point_1, point_2, point_3):
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Точки\n"
-                                    f"A {point_1}\n"
-                                    f"B {point_2}\n"
-                                    f"C {point_3}\n"
-                                    f"лежат на одной прямой. Сечение построить невозможно. "
-                                    f"Хотите ввести заново координаты точек?",
-                               reply_markup=auxiliary_kb.yes_no_kb())
-        bot.register_next_step_handler(msg, collinear_points_tetrahedron_answer, coefficient)
-        return
-    else:
-        # noinspection PyTypeChecker
-        fig, msg = build_section_tetrahedron(coefficient, point_1, point_2, point_3)
-        photo = figure_to_bytes(fig)
-        if msg:
-            bot.send_photo(chat_id=message.chat.id, photo=photo, caption=msg)
-        else:
-            bot.send_photo(chat_id=message.chat.id, photo=photo, caption="Тетраэдр с заданным сечением готов.")
-        bot.send_message(chat_id=message.chat.id, text=main_text, reply_markup=public_kb.select_figure())
+    if are_points_collinear(*points):
+        raise ValueError("Точки лежат на одной прямой. Сечение построить невозможно.")
+    return SectionCommand(dialog, tuple(map(float, dimensions)), tuple(points))
 
 
-def collinear_points_tetrahedron_answer(message: types.Message, coefficient: float) -> None:
-    if message.content_type != "text":
-        msg = bot.send_message(chat_id=message.chat.id, text="Вы можете указать только текст. "
-                                                             "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.yes_no_kb())
-        bot.register_next_step_handler(msg, collinear_points_tetrahedron_answer, coefficient)
-        return
-    if message.text == "Да ✅":
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Укажите через пробел координаты перовой точки для построения сечения тетраэдра.\n"
-                                    "Пример координат выглядит так (X Y Z).",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_first_point_tetrahedron_section, coefficient)
-        return
-    elif message.text == "Нет ❌":
-        bot.send_message(chat_id=message.chat.id, text=main_text,
-                         reply_markup=public_kb.select_figure())
-        return
-    else:
-        msg = bot.send_message(chat_id=message.chat.id, text="Укажите Да ✅ / Нет ❌",
-                               reply_markup=auxiliary_kb.yes_no_kb())
-        bot.register_next_step_handler(msg, collinear_points_tetrahedron_answer, coefficient)
+class Check(NamedTuple):
+    is_valid: Callable[[ChatState, str], bool]
+    error_text: str
+    keyboard: Optional[Callable[[], types.ReplyKeyboardMarkup]]
 
 
-# parallelepiped
-def get_length_of_parallelepiped(message: types.Message) -> None:
-    if message.content_type != "text":
-        msg = bot.send_message(chat_id=message.chat.id, text="Вы можете указать только текст. "
-                                                             "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_length_of_parallelepiped)
-        return
-    if message.text == "Отмена":
-        bot.send_message(chat_id=message.chat.id, text=main_text,
-                         reply_markup=public_kb.select_figure())
-        return
-    if not is_positive_number(message.text):
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Вы можете указать только целое или дробное число больше 0. "
-                                    "Попробуйте ещё раз.")
-        bot.register_next_step_handler(msg, get_length_of_parallelepiped)
-        return
-    length = float(message.text)
-    msg = bot.send_message(chat_id=message.chat.id, text="Укажите ширину для построения параллелепипеда.",
-                           reply_markup=auxiliary_kb.cancel_kb())
-    bot.register_next_step_handler(msg, get_width_of_parallelepiped, length)
+class Step(NamedTuple):
+    keyboard: Callable[[], types.ReplyKeyboardMarkup]
+    cancellable: bool
+    checks: Tuple[Check, ...]
+    action: Callable[[types.Message, ChatState], Awaitable[None]]
 
 
-def get_width_of_parallelepiped(message: types.Message, length: float) -> None:
-    if message.content_type != "text":
-        msg = bot.send_message(chat_id=message.chat.id, text="Вы можете указать только текст. "
-                                                             "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_width_of_parallelepiped, length)
-        return
-    if message.text == "Отмена":
-        bot.send_message(chat_id=message.chat.id, text=main_text,
-                         reply_markup=public_kb.select_figure())
-        return
-    if not is_positive_number(message.text):
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Вы можете указать только целое или дробное число больше 0. "
-                                    "Попробуйте ещё раз.")
-        bot.register_next_step_handler(msg, get_width_of_parallelepiped, length)
-        return
-    width = float(message.text)
-    msg = bot.send_message(chat_id=message.chat.id, text="Укажите высоту для построения параллелепипеда.",
+async def send_image(chat_id: int, photo: bytes, solid: Optional[str] = None, **kwargs) -> types.Message:
+    with metrics.timed("upload", solid):
+        # SVG Telegram не показывает как фото, такой рисунок отправляем файлом
+        if is_svg(photo):
+            document = BytesIO(photo)
+            document.name = file_name(photo)
+            return await bot.send_document(chat_id=chat_id, document=document, **kwargs)
+        return await file_ids.send_photo(bot, chat_id=chat_id, photo=photo, **kwargs)
+
+
+async def reply_render_error(message: types.Message, error: Exception) -> None:
+    await bot.send_message(chat_id=message.chat.id,
+                           text=busy_text if isinstance(error, RenderBusy) else timeout_text,
                            reply_markup=auxiliary_kb.cancel_kb())
-    bot.register_next_step_handler(msg, get_height_of_parallelepiped, length, width)
 
 
-def get_height_of_parallelepiped(message: types.Message, length: float, width: float) -> None:
-    if message.content_type != "text":
-        msg = bot.send_message(chat_id=message.chat.id, text="Вы можете указать только текст. "
-                                                             "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_height_of_parallelepiped, length, width)
-        return
-    if message.text == "Отмена":
-        bot.send_message(chat_id=message.chat.id, text=main_text,
-                         reply_markup=public_kb.select_figure())
-        return
-    if not is_positive_number(message.text):
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Вы можете указать только целое или дробное число больше 0. "
-                                    "Попробуйте ещё раз.")
-        bot.register_next_step_handler(msg, get_height_of_parallelepiped, length, width)
-        return
-    height = float(message.text)
-    t, ax, fig = build_parallelepiped(length, width, height)
-    photo = figure_to_bytes(fig)
-    msg = bot.send_photo(chat_id=message.chat.id, photo=photo,
-                         caption=f"Параллелепипед с "
-                                 f"длинной {length}, шириной {width} и высотой {height} готов.\n"
-                                 "Укажите через пробел координаты перовой точки для построения сечения "
-                                 "параллелепипеда.\n"
-                                 "Пример координат выглядит так (X Y Z).",
-                         reply_markup=auxiliary_kb.cancel_kb())
-    bot.register_next_step_handler(msg, get_first_point_parallelepiped_section, length, width, height)
-
-
-def get_first_point_parallelepiped_section(message: types.Message, length: float, width: float, height: float) -> None:
-    if message.content_type != "text":
-        msg = bot.send_message(chat_id=message.chat.id, text="Вы можете указать только текст. "
-                                                             "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_first_point_parallelepiped_section, length, width, height)
-        return
-    if message.text == "Отмена":
-        bot.send_message(chat_id=message.chat.id, text=main_text,
-                         reply_markup=public_kb.select_figure())
-        return
-    if not is_correct_coordinates(message.text):
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Вы можете указать только 3 целых или дробных числа через пробел. "
-                                    "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_first_point_parallelepiped_section, length, width, height)
-        return
-    point_1 = list(map(float, message.text.split()))
-    point_1[0], point_1[1] = point_1[1], point_1[0]
-    msg = bot.send_message(chat_id=message.chat.id,
-                           text="Укажите через пробел координаты второй точки для построения сечения параллелепипеда.\n"
-                                "Пример координат выглядит так (X Y Z).")
-    bot.register_next_step_handler(msg, get_second_point_parallelepiped_section, length, width, height, point_1)
+async def finish(message: types.Message, state: ChatState) -> None:
+    state.reset()
+    await bot.send_message(chat_id=message.chat.id, text=main_text, reply_markup=public_kb.select_figure())
 
 
-def get_second_point_parallelepiped_section(message: types.Message, length: float, width: float, height: float,
-                                            point_1: point) -> None:
-    if message.content_type != "text":
-        msg = bot.send_message(chat_id=message.chat.id, text="Вы можете указать только текст. "
-                                                             "Попробуйте ещё раз.",
+async def accept_dimension(message: types.Message, state: ChatState) -> None:
+    dialog = dialogs_by_kind[state.kind]
+    dimensions = state.dimensions + (float(message.text),)
+    if len(dimensions) < len(dialog.prompts):
+        state.dimensions = dimensions
+        await bot.send_message(chat_id=message.chat.id, text=dialog.prompts[len(dimensions)],
                                reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_second_point_parallelepiped_section, length, width, height,
-                                       point_1)
         return
-    if message.text == "Отмена":
-        bot.send_message(chat_id=message.chat.id, text=main_text,
-                         reply_markup=public_kb.select_figure())
+    try:
+        photo = await scheduler.run(message.chat.id, "solid", render_solid, dialog.kind, dimensions,
+                                    cached=lookup_solid, solid=dialog.kind)
+    except (RenderBusy, RenderTimeout) as e:
+        await reply_render_error(message, e)
         return
-    if not is_correct_coordinates(message.text):
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Вы можете указать только 3 целых или дробных числа через пробел. "
-                                    "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_second_point_parallelepiped_section, length, width, height,
-                                       point_1)
-        return
-    point_2 = list(map(float, message.text.split()))
-    point_2[0], point_2[1] = point_2[1], point_2[0]
-    if point_1 == point_2:
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Координаты этой точки совпадают с координатами предыдущей. "
-                                    "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_second_point_parallelepiped_section, length, width, height,
-                                       point_1)
+    except RenderSuperseded:
+        # пользователь уже прислал новое значение, ответит его обработчик
         return
-    msg = bot.send_message(chat_id=message.chat.id,
-                           text="Укажите через пробел координаты третей точки для построения сечения параллелепипеда.\n"
-                                "Пример координат выглядит так (X Y Z).")
-    bot.register_next_step_handler(msg, get_third_point_parallelepiped_section, length, width, height,
-                                   point_1, point_2)
+    state.dimensions = dimensions
+    state.step = "point"
+    await send_image(message.chat.id, photo, dialog.kind,
+                     caption=dialog.ready_text.format(*dimensions) + "\n" + point_prompt(dialog, 0),
+                     reply_markup=auxiliary_kb.cancel_kb())
 
 
-def get_third_point_parallelepiped_section(message: types.Message, length: float, width: float, height: float,
-                                           point_1: point, point_2: point) -> None:
-    if message.content_type != "text":
-        msg = bot.send_message(chat_id=message.chat.id, text="Вы можете указать только текст. "
-                                                             "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_third_point_parallelepiped_section, length, width, height,
-                                       point_1, point_2)
-        return
-    if message.text == "Отмена":
-        bot.send_message(chat_id=message.chat.id, text=main_text,
-                         reply_markup=public_kb.select_figure())
-        return
-    if not is_correct_coordinates(message.text):
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Вы можете указать только 3 целых или дробных числа через пробел. "
-                                    "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_third_point_parallelepiped_section, length, width, height,
-                                       point_1, point_2)
-        return
-    point_3 = list(map(float, message.text.split()))
-    point_3[0], point_3[1] = point_3[1], point_3[0]
-    if point_1 == point_3 or point_2 == point_3:
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Координаты этой точки совпадают с координатами предыдущей. "
-                                    "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_third_point_parallelepiped_section, length, width, height,
-                                       point_1, point_2)
+async def send_section(message: types.Message, state: ChatState, dialog: Dialog, dimensions: Tuple[float, ...],
+                       points: Tuple[list, ...], menu: bool = False) -> bool:
+    # menu: после сечения диалог закончен и нужно показать главное меню
+    point_1, point_2, point_3 = points
+    try:
+        # noinspection PyTypeChecker
+        photo, msg = await scheduler.run(message.chat.id, "section", render_section, dialog.kind, dimensions,
+                                         point_1, point_2, point_3, cached=lookup_section, solid=dialog.kind)
+    except (RenderBusy, RenderTimeout) as e:
+        await reply_render_error(message, e)
+        return False
+    except RenderSuperseded:
+        return False
+    if msg:
+        if menu:
+            # у такой картинки нет своих кнопок, так что меню уходит вместе с ней одним запросом
+            state.reset()
+            await send_image(message.chat.id, photo, dialog.kind, caption=f"{msg}\n{main_text}",
+                             reply_markup=public_kb.select_figure())
+        else:
+            await send_image(message.chat.id, photo, dialog.kind, caption=msg)
+        return True
+    state.section = (dialog.kind, dimensions, list(points))
+    sent = await send_image(message.chat.id, photo, dialog.kind, caption=dialog.section_ready_text,
+                            reply_markup=auxiliary_kb.section_kb(0, len(SECTION_VIEWS)))
+    state.section_message_id = sent.message_id
+    prerender_views(message.chat.id, state.section)
+    if menu:
+        # к сообщению можно прикрепить только одну клавиатуру, а кнопки поворота нужнее;
+        # меню идёт следом по тому же keep-alive соединению
+        await finish(message, state)
+    return True
+
+
+prerender_tasks = set()
+
+
+def prerender_views(chat_id: int, section: tuple) -> None:
+    # остальные ракурсы рисуются сразу после отправки, чтобы первый поворот тоже был попаданием в кэш
+    if len(SECTION_VIEWS) < 2:
         return
+    kind, dimensions, (point_1, point_2, point_3) = section
+
+    async def prerender() -> None:
+        # в той же группе, что и сечение: новое сечение вытесняет ещё не начатые ракурсы старого
+        try:
+            await scheduler.run(chat_id, "section", render_section_view, kind, dimensions, point_1, point_2, point_3,
+                                1, cached=lookup_section_view, background=True, solid=kind)
+        except (RenderBusy, RenderTimeout, RenderSuperseded):
+            pass
+
+    task = asyncio.create_task(prerender())
+    prerender_tasks.add(task)
+    task.add_done_callback(prerender_tasks.discard)
+
+
+async def accept_point(message: types.Message, state: ChatState) -> None:
+    dialog = dialogs_by_kind[state.kind]
+    points = state.points + (parse_point(message.text),)
+    if len(points) < 3:
+        state.points = points
+        await bot.send_message(chat_id=message.chat.id, text=point_prompt(dialog, len(points)))
+        return
+    point_1, point_2, point_3 = points
     # noinspection PyTypeChecker
     if are_points_collinear(point_1, point_2, point_3):
-        msg = bot.send_message(chat_id=message.chat.id,
+        state.points = ()
+        state.step = "collinear"
+        await bot.send_message(chat_id=message.chat.id,
                                text="Точки\n"
                                     f"A {point_1}\n"
                                     f"B {point_2}\n"
@@ -377,39 +331,177 @@ def get_third_point_parallelepiped_section(message: types.Message, length: float
                                     f"лежат на одной прямой. Сечение построить невозможно. "
                                     f"Хотите ввести заново координаты точек?",
                                reply_markup=auxiliary_kb.yes_no_kb())
-        bot.register_next_step_handler(msg, collinear_points_parallelepiped_answer, length, width, height)
         return
-    else:
-        # noinspection PyTypeChecker
-        fig, msg = build_section_parallelepiped(length, width, height, point_1, point_2, point_3)
-        photo = figure_to_bytes(fig)
-        if msg:
-            bot.send_photo(chat_id=message.chat.id, photo=photo, caption=msg)
-        else:
-            bot.send_photo(chat_id=message.chat.id, photo=photo, caption="Параллелепипед с заданным сечением готов.")
-        bot.send_message(chat_id=message.chat.id, text=main_text, reply_markup=public_kb.select_figure())
+    await send_section(message, state, dialog, state.dimensions, points, menu=True)
 
 
-def collinear_points_parallelepiped_answer(message: types.Message, length: float, width: float, height: float):
-    if message.content_type != "text":
-        msg = bot.send_message(chat_id=message.chat.id, text="Вы можете указать только текст. "
-                                                             "Попробуйте ещё раз.",
-                               reply_markup=auxiliary_kb.yes_no_kb())
-        bot.register_next_step_handler(msg, collinear_points_parallelepiped_answer, length, width, height)
-        return
-    if message.text == "Да ✅":
-        msg = bot.send_message(chat_id=message.chat.id,
-                               text="Укажите через пробел координаты перовой точки для построения сечения "
-                                    "параллелепипеда.\n"
-                                    "Пример координат выглядит так (X Y Z).",
-                               reply_markup=auxiliary_kb.cancel_kb())
-        bot.register_next_step_handler(msg, get_first_point_parallelepiped_section, length, width, height)
+async def answer_collinear(message: types.Message, state: ChatState) -> None:
+    if message.text == no_text:
+        await finish(message, state)
         return
-    elif message.text == "Нет ❌":
-        bot.send_message(chat_id=message.chat.id, text=main_text,
-                         reply_markup=public_kb.select_figure())
+    state.step = "point"
+    await bot.send_message(chat_id=message.chat.id, text=point_prompt(dialogs_by_kind[state.kind], 0),
+                           reply_markup=auxiliary_kb.cancel_kb())
+
+
+# шаги диалога: клавиатура для повторного ввода, можно ли отменить шаг, проверки ввода по порядку
+# (с текстом ошибки и клавиатурой) и действие над корректным вводом, которое выбирает следующий шаг
+steps = {
+    "dimension": Step(auxiliary_kb.cancel_kb, True, (
+        Check(lambda state, text: is_positive_number(text),
+              "Вы можете указать только целое или дробное число больше 0. Попробуйте ещё раз.", None),
+    ), accept_dimension),
+    "point": Step(auxiliary_kb.cancel_kb, True, (
+        Check(lambda state, text: is_correct_coordinates(text),
+              "Вы можете указать только 3 целых или дробных числа через пробел. Попробуйте ещё раз.",
+              auxiliary_kb.cancel_kb),
+        Check(lambda state, text: parse_point(text) not in state.points,
+              "Координаты этой точки совпадают с координатами предыдущей. Попробуйте ещё раз.",
+              auxiliary_kb.cancel_kb),
+    ), accept_point),
+    "collinear": Step(auxiliary_kb.yes_no_kb, False, (
+        Check(lambda state, text: text in (yes_text, no_text), "Укажите Да ✅ / Нет ❌", auxiliary_kb.yes_no_kb),
+    ), answer_collinear),
+}
+
+
+def active_state(message: types.Message) -> Optional[ChatState]:
+    state = states.get(message.chat.id)
+    if state is None or state.step is None:
+        return None
+    return state
+
+
+# команда обрабатывается раньше шагов диалога, чтобы работать и посреди начатого ввода
+@bot.message_handler(commands=['section'])
+async def section_command(message: types.Message) -> None:
+    arguments = util.extract_arguments(message.text)
+    if not arguments:
+        await bot.send_message(chat_id=message.chat.id, text=section_usage)
+        return
+    try:
+        with metrics.timed("parse", None):
+            command = parse_section_command(arguments)
+    except ValueError as e:
+        await bot.send_message(chat_id=message.chat.id, text=str(e))
+        return
+    state = states.get(message.chat.id) or ChatState(message.chat.id)
+    state.reset()
+    with metrics.timed("request", command.dialog.kind):
+        await send_section(message, state, command.dialog, command.dimensions, command.points)
+    states.put(state)
+
+
+@bot.message_handler(func=lambda message: active_state(message) is not None, content_types=util.content_type_media)
+async def process_step(message: types.Message) -> None:
+    state = active_state(message)
+    if state is None:
         return
-    else:
-        msg = bot.send_message(chat_id=message.chat.id, text="Укажите Да ✅ / Нет ❌",
-                               reply_markup=auxiliary_kb.yes_no_kb())
-        bot.register_next_step_handler(msg, collinear_points_parallelepiped_answer, length, width, height)
+    step = steps[state.step]
+    if message.content_type != "text":
+        await bot.send_message(chat_id=message.chat.id, text=only_text, reply_markup=step.keyboard())
+        return
+    if step.cancellable and message.text == "Отмена":
+        state.reset()
+        states.put(state)
+        await bot.send_message(chat_id=message.chat.id, text=main_text,
+                               reply_markup=public_kb.select_figure())
+        return
+    with metrics.timed("parse", state.kind):
+        error = next((check for check in step.checks if not check.is_valid(state, message.text)), None)
+    if error is not None:
+        await bot.send_message(chat_id=message.chat.id, text=error.error_text,
+                               reply_markup=error.keyboard() if error.keyboard else None)
+        return
+    try:
+        with metrics.timed("request", state.kind):
+            await step.action(message, state)
+    finally:
+        # в памяти состояние меняется по ссылке и сохраняется даже после ошибки отправки,
+        # в sqlite - только через put, поэтому сохраняем в любом случае, чтобы хранилища вели себя одинаково
+        states.put(state)
+
+
+@bot.message_handler(commands=['start'])
+async def start(message: types.Message) -> None:
+    await bot.send_message(chat_id=message.chat.id, text=main_text,
+                           reply_markup=public_kb.select_figure())
+
+
+@bot.message_handler(content_types=['text'])
+async def get_figure_name(message: types.Message) -> None:
+    dialog = dialogs.get(message.text)
+    if dialog is None:
+        return
+    state = states.get(message.chat.id) or ChatState(message.chat.id)
+    state.reset()
+    state.step = "dimension"
+    state.kind = dialog.kind
+    states.put(state)
+    await bot.send_message(chat_id=message.chat.id, text=dialog.prompts[0],
+                           reply_markup=auxiliary_kb.cancel_kb())
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("view:"))
+async def rotate_view(call: types.CallbackQuery) -> None:
+    state = states.get(call.message.chat.id)
+    if state is None or state.section is None or state.section_message_id != call.message.message_id:
+        await bot.answer_callback_query(callback_query_id=call.id, text="Постройте сечение заново.")
+        return
+    # ответ на нажатие не зависит от рендера и уходит параллельно с ним
+    answered = asyncio.ensure_future(bot.answer_callback_query(callback_query_id=call.id))
+    try:
+        await show_view(call, state, int(call.data.split(":")[1]) % len(SECTION_VIEWS))
+    finally:
+        await answered
+
+
+async def show_view(call: types.CallbackQuery, state: ChatState, view: int) -> None:
+    kind, dimensions, (point_1, point_2, point_3) = state.section
+    try:
+        with metrics.timed("rotate", kind):
+            photo = await scheduler.run(call.message.chat.id, "view", render_section_view, kind, dimensions,
+                                        point_1, point_2, point_3, view, cached=lookup_section_view, solid=kind)
+    except (RenderBusy, RenderTimeout) as e:
+        await bot.send_message(chat_id=call.message.chat.id,
+                               text=busy_text if isinstance(e, RenderBusy) else timeout_text)
+        return
+    except RenderSuperseded:
+        # быстрые нажатия подряд: показываем только ракурс последнего
+        return
+    with metrics.timed("upload", kind):
+        await file_ids.edit_photo(bot, call.message.chat.id, call.message.message_id, photo,
+                                  caption=call.message.caption,
+                                  reply_markup=auxiliary_kb.section_kb(view, len(SECTION_VIEWS)))
+
+
+@bot.callback_query_handler(func=lambda call: call.data == "sweep")
+async def send_sweep(call: types.CallbackQuery) -> None:
+    state = states.get(call.message.chat.id)
+    # кнопка под старым сечением анимировала бы последнее построенное, а не своё
+    if state is None or state.section is None or state.section_message_id != call.message.message_id:
+        await bot.answer_callback_query(callback_query_id=call.id, text="Постройте сечение заново.")
+        return
+    answered = asyncio.ensure_future(bot.answer_callback_query(callback_query_id=call.id))
+    try:
+        await send_sweep_animation(call, state)
+    finally:
+        await answered
+
+
+async def send_sweep_animation(call: types.CallbackQuery, state: ChatState) -> None:
+    kind, dimensions, (point_1, point_2, point_3) = state.section
+    try:
+        with metrics.timed("sweep", kind):
+            animation = await scheduler.run(call.message.chat.id, "sweep", render_sweep, kind, dimensions,
+                                            point_1, point_2, point_3, cached=lookup_sweep, solid=kind)
+    except (RenderBusy, RenderTimeout) as e:
+        await bot.send_message(chat_id=call.message.chat.id,
+                               text=busy_text if isinstance(e, RenderBusy) else timeout_text)
+        return
+    except RenderSuperseded:
+        return
+    file = BytesIO(animation)
+    file.name = "section.gif"
+    await bot.send_animation(chat_id=call.message.chat.id, animation=file,
+                             caption="Секущая плоскость проходит через всю фигуру.")
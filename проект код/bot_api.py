@@ -0,0 +1,108 @@
+import asyncio
+import logging
+
+import aiohttp
+from telebot import asyncio_helper
+from telebot.asyncio_helper import ApiHTTPException, ApiTelegramException, RequestTimeout
+
+logger = logging.getLogger(__name__)
+
+# повтор после сетевой ошибки или 5xx безопасен только для запросов, которые не создают сообщений
+idempotent_prefixes = ("get", "answer", "edit", "delete", "set")
+
+
+class PooledSessionManager(asyncio_helper.SessionManager):
+    # одна сессия на все запросы к Bot API: соединения переиспользуются (keep-alive),
+    # а лимит коннектора ограничивает число одновременных запросов
+    def __init__(self, connections: int, keepalive: float):
+        super().__init__()
+        self.connections = connections
+        self.keepalive = keepalive
+        self.sessions = 0
+
+    async def create_session(self) -> aiohttp.ClientSession:
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+            limit=self.connections,
+            keepalive_timeout=self.keepalive,
+            ttl_dns_cache=300,
+            ssl=self.ssl_context,
+        ))
+        self.sessions += 1
+        return self.session
+
+    def stats(self) -> dict:
+        connector = self.session.connector if self.session is not None and not self.session.closed else None
+        return {
+            "sessions": self.sessions,
+            "connections_limit": self.connections,
+            # noinspection PyProtectedMember
+            "idle_connections": sum(len(c) for c in connector._conns.values()) if connector is not None else 0,
+        }
+
+
+class RetryStats:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "failed": self.failed,
+        }
+
+
+retry_stats = RetryStats()
+
+
+def _rewind(files) -> None:
+    # файл уже прочитан при первой попытке, при повторе его нужно отправить с начала
+    for value in (files or {}).values():
+        if isinstance(value, tuple):
+            value = value[-1]
+        value = getattr(value, "file", value)
+        if hasattr(value, "seek"):
+            value.seek(0)
+
+
+def install(connections: int, keepalive: float, retries: int, backoff: float, max_retry_after: float) -> None:
+    asyncio_helper.session_manager = PooledSessionManager(connections, keepalive)
+    process_request = asyncio_helper._process_request
+
+    async def process_request_with_retries(token, url, method="get", params=None, files=None, **kwargs):
+        retry_stats.requests += 1
+        for attempt in range(retries + 1):
+            try:
+                # telebot забирает timeout из params, поэтому каждой попытке - своя копия
+                return await process_request(token, url, method, dict(params) if params else params, files,
+                                             **kwargs)
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    retry_after = (e.result_json.get("parameters") or {}).get("retry_after", backoff)
+                    retry_stats.rate_limited += 1
+                    if attempt == retries or retry_after > max_retry_after:
+                        retry_stats.failed += 1
+                        raise
+                    delay = retry_after
+                elif e.error_code >= 500 and url.startswith(idempotent_prefixes):
+                    if attempt == retries:
+                        retry_stats.failed += 1
+                        raise
+                    delay = backoff * 2 ** attempt
+                else:
+                    raise
+            except (ApiHTTPException, RequestTimeout):
+                if attempt == retries or not url.startswith(idempotent_prefixes):
+                    retry_stats.failed += 1
+                    raise
+                delay = backoff * 2 ** attempt
+            retry_stats.retries += 1
+            logger.warning("Bot API %s: повтор через %.1f с (попытка %d)", url, delay, attempt + 2)
+            await asyncio.sleep(delay)
+            _rewind(files)
+
+    asyncio_helper._process_request = process_request_with_retries
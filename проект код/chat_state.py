@@ -0,0 +1,134 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+
+class ChatState:
+    __slots__ = ("chat_id", "step", "kind", "dimensions", "points", "section", "updated", "section_message_id")
+
+    def __init__(self, chat_id: int, step: Optional[str] = None, kind: Optional[str] = None,
+                 dimensions: Tuple[float, ...] = (), points: Tuple[List[float], ...] = (),
+                 section: Optional[tuple] = None, updated: float = 0.0, section_message_id: Optional[int] = None):
+        self.chat_id = chat_id
+        self.step = step
+        self.kind = kind
+        self.dimensions = dimensions
+        self.points = points
+        self.section = section
+        self.updated = updated
+        # сообщение с картинкой сечения, только его можно поворачивать кнопками
+        self.section_message_id = section_message_id
+
+    def reset(self) -> None:
+        self.step = None
+        self.kind = None
+        self.dimensions = ()
+        self.points = ()
+
+    def dumps(self) -> str:
+        return json.dumps([self.step, self.kind, self.dimensions, self.points, self.section, self.updated,
+                           self.section_message_id])
+
+    @classmethod
+    def loads(cls, chat_id: int, data: str) -> "ChatState":
+        # состояния, сохранённые до появления section_message_id, содержат на одно поле меньше
+        step, kind, dimensions, points, section, updated, *rest = json.loads(data)
+        if section is not None:
+            section_kind, section_dimensions, section_points = section
+            section = (section_kind, tuple(section_dimensions), section_points)
+        return cls(chat_id, step, kind, tuple(dimensions), tuple(points), section, updated, *rest)
+
+
+class MemoryStateStorage:
+    def __init__(self, ttl: float, max_chats: int):
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self.evictions = 0
+
+        # порядок словаря совпадает с порядком последних обновлений, поэтому устаревшие записи всегда в начале
+        self._states: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chat_id: int) -> Optional[ChatState]:
+        with self._lock:
+            state = self._states.get(chat_id)
+            if state is not None and state.updated < time.time() - self.ttl:
+                del self._states[chat_id]
+                self.evictions += 1
+                return None
+            return state
+
+    def put(self, state: ChatState) -> None:
+        state.updated = time.time()
+        with self._lock:
+            self._states[state.chat_id] = state
+            self._states.move_to_end(state.chat_id)
+            self._evict(state.updated)
+
+    def delete(self, chat_id: int) -> None:
+        with self._lock:
+            self._states.pop(chat_id, None)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def _evict(self, now: float) -> None:
+        while self._states:
+            chat_id, oldest = next(iter(self._states.items()))
+            if len(self._states) <= self.max_chats and oldest.updated >= now - self.ttl:
+                break
+            del self._states[chat_id]
+            self.evictions += 1
+
+
+class SqliteStateStorage:
+    def __init__(self, path: str, ttl: float, evict_every: int = 1000):
+        self.ttl = ttl
+        self.evict_every = evict_every
+        self.evictions = 0
+
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS chat_states "
+                                 "(chat_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS chat_states_updated ON chat_states (updated)")
+        self._connection.commit()
+
+    def get(self, chat_id: int) -> Optional[ChatState]:
+        with self._lock:
+            row = self._connection.execute("SELECT data, updated FROM chat_states WHERE chat_id = ?",
+                                           (chat_id,)).fetchone()
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        return ChatState.loads(chat_id, row[0])
+
+    def put(self, state: ChatState) -> None:
+        state.updated = time.time()
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO chat_states (chat_id, data, updated) VALUES (?, ?, ?)",
+                                     (state.chat_id, state.dumps(), state.updated))
+            self._puts += 1
+            if self._puts % self.evict_every == 0:
+                cursor = self._connection.execute("DELETE FROM chat_states WHERE updated < ?",
+                                                  (state.updated - self.ttl,))
+                self.evictions += cursor.rowcount
+            self._connection.commit()
+
+    def delete(self, chat_id: int) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM chat_states WHERE chat_id = ?", (chat_id,))
+            self._connection.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM chat_states").fetchone()[0]
+
+
+def make_storage(kind: str, path: str, ttl: float, max_chats: int):
+    if kind == "sqlite":
+        return SqliteStateStorage(path, ttl)
+    return MemoryStateStorage(ttl, max_chats)
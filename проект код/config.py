@@ -1 +1,79 @@
+import os
+
 TOKEN = "Укажите токен"
+
+# "matplotlib" - полноценная 3D-сцена с осями и сеткой, "pillow" - быстрый каркасный рендер без matplotlib
+RENDER_BACKEND = "matplotlib"
+
+# формат ответа: "png", "jpeg", "webp" или "svg" (SVG уходит документом и есть только у matplotlib)
+IMAGE_FORMAT = "png"
+IMAGE_SIZE = (640, 480)
+IMAGE_DPI = 100
+# число цветов палитры для PNG, None - без квантования
+IMAGE_COLORS = 128
+# качество JPEG/WebP
+IMAGE_QUALITY = 85
+PNG_COMPRESS_LEVEL = 6
+
+RENDER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# ракурсы для кнопок поворота сечения: (азимут, наклон) в градусах, первый - исходный вид
+SECTION_VIEWS = ((-60, 30), (30, 30), (120, 30), (210, 30), (-60, 75))
+# число сечений в кэше геометрии (ключ - фигура, размеры и каноническая плоскость)
+GEOMETRY_CACHE_SIZE = 4096
+RENDER_CACHE_DIR = None
+# бюджет дискового кэша рендеров, при превышении удаляются картинки, к которым дольше всего не обращались
+RENDER_CACHE_DIR_MAX_BYTES = 512 * 1024 * 1024
+FILE_ID_DB = "file_ids.sqlite3"
+# хранилище состояния диалогов: "memory" или "sqlite" (переживает перезапуск)
+STATE_STORAGE = "memory"
+STATE_DB = "states.sqlite3"
+STATE_TTL = 24 * 60 * 60
+STATE_MAX_CHATS = 100000
+
+# адрес Bot API, например "http://127.0.0.1:8081/bot{0}/{1}" для локального сервера; None - api.telegram.org
+API_URL = None
+# все запросы к Bot API идут через одну сессию: не больше API_CONNECTIONS соединений, простаивающее
+# соединение живёт API_KEEPALIVE секунд; 429 повторяется через retry_after (если он не больше
+# API_MAX_RETRY_AFTER), ошибки сети и 5xx - с экспоненциальной паузой и только для запросов без побочных эффектов
+API_CONNECTIONS = 32
+API_KEEPALIVE = 60
+API_RETRIES = 3
+API_BACKOFF = 0.5
+API_MAX_RETRY_AFTER = 30
+
+# если WEBHOOK_URL не задан, бот получает апдейты через long polling
+WEBHOOK_URL = None
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_SECRET = None
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8080
+WEBHOOK_BATCH_SIZE = 100
+
+RENDER_WORKERS = os.cpu_count() or 1
+RENDER_QUEUE_SIZE = 32
+RENDER_TIMEOUT = 30
+RENDER_START_METHOD = "forkserver"
+# прогрев matplotlib при старте: "background" - в фоне, бот сразу принимает апдейты;
+# "blocking" - бот стартует после прогрева; "lazy" - matplotlib загрузится на первом запросе
+RENDER_WARM_UP = "background"
+# пул воркеров рендера меняется на новый после RENDER_RECYCLE_AFTER рендеров или когда какой-то воркер
+# превысил RENDER_MAX_WORKER_RSS байт; начатые рендеры доделывает старый пул. None - без ограничения
+RENDER_RECYCLE_AFTER = 5000
+RENDER_MAX_WORKER_RSS = 512 * 1024 * 1024
+# очередь рендеров обслуживает чаты по кругу; у каждого чата бакет на CHAT_RENDER_BURST рендеров,
+# пополняемый на CHAT_RENDER_RATE в секунду (None - без ограничения), и не больше CHAT_MAX_PENDING ожидающих;
+# всего ожидающих не больше RENDER_QUEUE_SIZE, сверх этого пользователь получает «сервер занят»
+CHAT_RENDER_RATE = 0.5
+CHAT_RENDER_BURST = 5
+CHAT_MAX_PENDING = 4
+
+# время этапов обработки (p50/p95/p99 по типам фигур) и счётчики кэшей в формате Prometheus
+METRICS_ENABLED = False
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9100
+METRICS_WINDOW = 1024
+# сколько уже ненужных фигур matplotlib может ждать сборщика мусора, прежде чем воркер запустит его сам
+MEMORY_MAX_LIVE_FIGURES = 16
+# снимки tracemalloc по запросу на сервере метрик: POST /memory/snapshot, POST /memory/stop
+MEMORY_TRACE_FRAMES = 10
+MEMORY_TRACE_TOP = 20
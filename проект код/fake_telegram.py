@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+
+# Заглушка Bot API для нагрузочных прогонов: бот подключается к ней через API_URL в config.py,
+# например API_URL = "http://127.0.0.1:8081/bot{0}/{1}", а генератор нагрузки играет роль пользователей.
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.calls: Counter = Counter()
+        self.uploaded_bytes = 0
+        self.polls = 0
+        self.connected = asyncio.Event()
+
+        self._ids = itertools.count(1)
+        self._updates: List[dict] = []
+        self._new_update = asyncio.Event()
+        self._inboxes: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        return app
+
+    # --- сторона пользователей ---
+
+    def send_text(self, chat_id: int, text: str) -> None:
+        self._push({"message": {
+            "message_id": next(self._ids), "date": int(time.time()), "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+        }})
+
+    def inbox(self, chat_id: int) -> asyncio.Queue:
+        return self._inboxes[chat_id]
+
+    def forget(self, chat_id: int) -> None:
+        self._inboxes.pop(chat_id, None)
+
+    def _push(self, update: dict) -> None:
+        update["update_id"] = next(self._ids)
+        self._updates.append(update)
+        self._new_update.set()
+
+    # --- сторона бота ---
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = await self._read_params(request)
+        if method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "section_bot", "username": "section_bot"}
+        elif method.startswith(("send", "edit")):
+            result = self._reply(method, params)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _read_params(self, request: web.Request) -> dict:
+        # telebot шлёт параметры формой даже в GET-запросах, поэтому request.post() не подходит
+        params = dict(request.query)
+        if request.content_type == "multipart/form-data":
+            reader = await request.multipart()
+            async for part in reader:
+                if part.filename:
+                    data = await part.read()
+                    self.uploaded_bytes += len(data)
+                    params[part.name] = data
+                else:
+                    params[part.name] = await part.text()
+        elif request.can_read_body:
+            params.update(parse_qsl(await request.text()))
+        return params
+
+    async def _get_updates(self, params: dict) -> List[dict]:
+        self.polls += 1
+        self.connected.set()
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        deadline = time.monotonic() + float(params.get("timeout", 0))
+        while True:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            if self._updates or time.monotonic() >= deadline:
+                return self._updates[:limit]
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                pass
+
+    def _reply(self, method: str, params: dict) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        message = {"message_id": int(params.get("message_id", 0)) or next(self._ids), "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private"}}
+        if "text" in params:
+            message["text"] = params["text"]
+        if "caption" in params:
+            message["caption"] = params["caption"]
+        if method == "sendPhoto":
+            message["photo"] = [{"file_id": f"photo{message['message_id']}", "file_unique_id": "u",
+                                 "width": 640, "height": 480}]
+        elif method == "sendAnimation":
+            message["animation"] = {"file_id": f"animation{message['message_id']}", "file_unique_id": "u",
+                                    "width": 640, "height": 480, "duration": 3}
+        elif method == "sendDocument":
+            message["document"] = {"file_id": f"document{message['message_id']}", "file_unique_id": "u"}
+        if "reply_markup" in params:
+            # как и настоящий Bot API, в сообщении возвращается только inline-клавиатура
+            markup = json.loads(params["reply_markup"])
+            if "inline_keyboard" in markup:
+                message["reply_markup"] = markup
+        inbox = self._inboxes.get(chat_id)
+        if inbox is not None:
+            inbox.put_nowait((method, message))
+        return message
+
+
+def percentile(samples: List[float], q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(int(q * len(samples)), len(samples) - 1)] if samples else 0.0
+
+
+class Step(NamedTuple):
+    text: str
+    replies: int
+    photo: bool
+
+
+def tetrahedron_dialog(rng: random.Random, distinct: int) -> List[Step]:
+    return [Step("/start", 1, False), Step("Тетраэдр", 1, False), Step(str(rng.randint(1, distinct)), 1, True),
+            Step("0 0 0.3", 1, False), Step("1 0 0.4", 1, False), Step("0 1 0.5", 2, True)]
+
+
+def parallelepiped_dialog(rng: random.Random, distinct: int) -> List[Step]:
+    return [Step("/start", 1, False), Step("Параллелепипед", 1, False), Step(str(rng.randint(1, distinct)), 1, False),
+            Step("2", 1, False), Step("3", 1, True),
+            Step("0 0 0.5", 1, False), Step("1 0 0.7", 1, False), Step("0 1 0.9", 2, True)]
+
+
+dialogs = {"tetrahedron": tetrahedron_dialog, "parallelepiped": parallelepiped_dialog}
+
+
+class LoadReport:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.dialogs = 0
+        self.failed = 0
+        self.errors: Counter = Counter()
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def print(self, server: FakeTelegram) -> None:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        total = self.dialogs + self.failed
+        print(f"Диалогов: {self.dialogs} успешно, {self.failed} с ошибками за {elapsed:.1f} с "
+              f"({self.dialogs / elapsed:.1f} диалогов/с, ошибок {self.failed / max(total, 1):.1%})")
+        updates = sum(len(samples) for name, samples in self.latencies.items() if name != "dialog")
+        print(f"Сообщений пользователей: {updates} ({updates / elapsed:.1f}/с), "
+              f"вызовов API: {sum(server.calls.values())}, загружено {server.uploaded_bytes / 1e6:.1f} МБ")
+        print(f"{'этап':12} {'n':>7} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'max, мс':>9}")
+        for name, samples in sorted(self.latencies.items()):
+            print(f"{name:12} {len(samples):7d} " + " ".join(
+                f"{percentile(samples, q) * 1000:9.1f}" for q in (0.5, 0.95, 0.99, 1.0)))
+        for error, count in self.errors.most_common():
+            print(f"ошибка: {error} x{count}")
+
+
+async def run_user(server: FakeTelegram, report: LoadReport, chat_id: int, kind: str, rng: random.Random,
+                   distinct: int, timeout: float, think: float) -> None:
+    inbox = server.inbox(chat_id)
+    dialog_start = time.perf_counter()
+    try:
+        for step in dialogs[kind](rng, distinct):
+            start = time.perf_counter()
+            server.send_text(chat_id, step.text)
+            for i in range(step.replies):
+                method, message = await asyncio.wait_for(inbox.get(), timeout)
+                if step.photo and i == 0 and method != "sendPhoto":
+                    # вместо картинки бот ответил текстом: перегрузка, таймаут рендера и т.п.
+                    report.failed += 1
+                    report.errors[message.get("text", method)[:60]] += 1
+                    return
+            report.latencies["photo" if step.photo else "text"].append(time.perf_counter() - start)
+            if think:
+                await asyncio.sleep(rng.expovariate(1 / think))
+    except asyncio.TimeoutError:
+        report.failed += 1
+        report.errors[f"нет ответа за {timeout:g} с"] += 1
+    else:
+        report.dialogs += 1
+        report.latencies["dialog"].append(time.perf_counter() - dialog_start)
+    finally:
+        server.forget(chat_id)
+
+
+async def run_load(host: str, port: int, users: int, ramp: float, kinds: List[str], distinct: int,
+                   timeout: float, think: float, seed: int) -> None:
+    server = FakeTelegram()
+    runner = web.AppRunner(server.make_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Bot API слушает http://{host}:{port}, укажите API_URL = \"http://{host}:{port}/bot{{0}}/{{1}}\"")
+    await server.connected.wait()
+    print(f"Бот подключился, запускаем {users} пользователей")
+
+    rng = random.Random(seed)
+    report = LoadReport()
+    tasks = []
+    for i in range(users):
+        kind = kinds[i % len(kinds)]
+        tasks.append(asyncio.create_task(run_user(server, report, 10 ** 6 + i, kind, random.Random(rng.random()),
+                                                  distinct, timeout, think)))
+        if ramp:
+            await asyncio.sleep(ramp / users)
+    await asyncio.gather(*tasks)
+    report.finished = time.perf_counter()
+    report.print(server)
+    await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API и генератор нагрузки")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--users", type=int, default=100, help="сколько пользователей проходят диалог")
+    parser.add_argument("--ramp", type=float, default=0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--solid", action="append", choices=sorted(dialogs), help="по умолчанию оба диалога")
+    parser.add_argument("--distinct", type=int, default=10,
+                        help="сколько разных размеров фигур, меньше - чаще попадания в кэш рендера")
+    parser.add_argument("--timeout", type=float, default=60, help="сколько ждать ответа бота")
+    parser.add_argument("--think", type=float, default=0, help="средняя пауза пользователя между сообщениями")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run_load(args.host, args.port, args.users, args.ramp, args.solid or sorted(dialogs),
+                         args.distinct, args.timeout, args.think, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,32 @@
 from solid_geometry import *
+from config import (RENDER_CACHE_MAX_BYTES, RENDER_CACHE_DIR, RENDER_CACHE_DIR_MAX_BYTES, RENDER_BACKEND, IMAGE_DPI,
+                    SECTION_VIEWS)
+from render_cache import RenderCache, make_key
+from metrics import timed
+from memory import track_figure
+from image_encoding import encode_figure, encoding_key, figure_size
+import pillow_renderer
 
 import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d.art3d import Poly3DCollection
-from matplotlib import transforms
+import threading
 
-from io import BytesIO
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
 
-
-def normalize_section(section, point_1, point_2, point_3):
-    if is_perpendicular_to_xy_plane(point_1, point_2, point_3):
-        section[:, 2] += np.random.normal(scale=0.001, size=len(section))
-    elif is_perpendicular_to_xz_plane(point_1, point_2, point_3):
-        section[:, 1] += np.random.normal(scale=0.001, size=len(section))
-    elif is_perpendicular_to_yz_plane(point_1, point_2, point_3):
-        section[:, 0] += np.random.normal(scale=0.001, size=len(section))
-
-    return section
+render_cache = RenderCache(RENDER_CACHE_MAX_BYTES, RENDER_CACHE_DIR, RENDER_CACHE_DIR_MAX_BYTES)
 
 
 def build_figure(vertices, faces):
-    fig = plt.figure()
+    # matplotlib импортируется при первой отрисовке, чтобы бот стартовал без него (см. warm_up)
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+
+    # Figure без pyplot не попадает в глобальный реестр фигур, её освобождает сборщик мусора,
+    # а отдельный холст на каждый запрос позволяет рисовать из нескольких потоков
+    fig = Figure(figsize=figure_size(), dpi=IMAGE_DPI)
+    FigureCanvasAgg(fig)
+    track_figure(fig)
     ax = fig.add_subplot(111, projection='3d')
     ax.grid(True)
 
@@ -45,77 +51,231 @@ def build_figure(vertices, faces):
     return ax, fig
 
 
-def build_parallelepiped(length: float, width: float, height: float):
-    parallelepiped = Parallelepiped(length, width, height)
+def section_message(section) -> Optional[str]:
+    if len(section) == 0:
+        return "Нет точек сечения."
+    if len(np.unique(section, axis=0)) < 3:
+        return "Недостаточно точек для визуализации сечения."
+    return None
 
-    vertices = parallelepiped.get_vertices()
-    faces = parallelepiped.get_faces()
 
-    ax, fig = build_figure(vertices, faces)
+def add_section(ax, section) -> Optional[str]:
+    from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 
-    return parallelepiped, ax, fig
+    message = section_message(section)
+    if len(section) != 0:
+        ax.scatter(section[:, 0], section[:, 1], section[:, 2], c='r', marker='o')
+    if message is None:
+        ax.add_collection3d(Poly3DCollection([section], facecolors='red', alpha=0.4))
+    return message
 
 
-def build_section_parallelepiped(length: float, width: float, height: float,
-                                 point_1: point, point_2: point, point_3: point):
-    parallelepiped, ax, fig = build_parallelepiped(length, width, height)
+def build_solid(solid: ConvexPolyhedron):
+    vertices = solid.get_vertices()
+    faces = solid.get_faces()
 
-    section = normalize_section(parallelepiped.intersect_plane_with_edges(point_1, point_2, point_3),
-                                point_1, point_2, point_3)
+    return build_figure(vertices, faces)
+
+
+def build_section(solid: ConvexPolyhedron, point_1: point, point_2: point, point_3: point):
+    ax, fig = build_solid(solid)
+
+    section = solid.section_polygon(point_1, point_2, point_3)
+    message = add_section(ax, section)
 
-    if len(section) != 0:
-        ax.scatter(section[:, 0], section[:, 1], section[:, 2], c='r', marker='o')
-    else:
-        message = "Нет точек сечения."
-        return fig, message
-
-    unique_points = np.unique(section, axis=0)
-    if len(unique_points) < 3:
-        message = "Недостаточно точек для визуализации сечения."
-        return fig, message
-    else:
-        ax.plot_trisurf(section[:, 0], section[:, 1], section[:, 2], color='red', alpha=0.4)
-
-    message = None
     return fig, message
 
 
-def build_tetrahedron(coefficient: float):
-    tetrahedron = Tetrahedron(coefficient)
+def build_parallelepiped(length: float, width: float, height: float):
+    parallelepiped = Parallelepiped(length, width, height)
+    ax, fig = build_solid(parallelepiped)
+
+    return parallelepiped, ax, fig
+
+
+def build_section_parallelepiped(length: float, width: float, height: float,
+                                 point_1: point, point_2: point, point_3: point):
+    return build_section(Parallelepiped(length, width, height), point_1, point_2, point_3)
 
-    vertices = tetrahedron.get_vertices()
-    faces = tetrahedron.get_faces()
 
-    ax, fig = build_figure(vertices, faces)
+def build_tetrahedron(coefficient: float):
+    tetrahedron = Tetrahedron(coefficient)
+    ax, fig = build_solid(tetrahedron)
 
     return tetrahedron, ax, fig
 
 
 def build_section_tetrahedron(coefficient: float,
                               point_1: point, point_2: point, point_3: point):
-    tetrahedron, ax, fig = build_tetrahedron(coefficient)
+    return build_section(Tetrahedron(coefficient), point_1, point_2, point_3)
 
-    section = normalize_section(tetrahedron.intersect_plane_with_edges(point_1, point_2, point_3),
-                                point_1, point_2, point_3)
 
-    message = None
-    if len(section) != 0:
-        ax.scatter(section[:, 0], section[:, 1], section[:, 2], c='r', marker='o')
-    else:
-        message = "Нет точек сечения."
-        return fig, message
+def figure_to_bytes(fig) -> bytes:
+    return encode_figure(fig)
 
-    unique_points = np.unique(section, axis=0)
-    if len(unique_points) < 3:
-        message = "Недостаточно точек для визуализации сечения."
-        return fig, message
-    else:
-        ax.plot_trisurf(section[:, 0], section[:, 1], section[:, 2], color='red', alpha=0.4)
 
-    return fig, message
+def release_figure(fig) -> None:
+    fig.clear()
+    fig.canvas = None
 
 
-def figure_to_bytes(fig) -> bytes:
-    buf = BytesIO()
-    fig.savefig(buf, format='png')
-    return buf.getvalue()
+def draw_solid(kind: str, dimensions: Tuple[float, ...]) -> bytes:
+    if RENDER_BACKEND == "pillow":
+        return pillow_renderer.draw_solid(kind, dimensions)
+    with timed("render", kind):
+        ax, fig = build_solid(make_solid(kind, tuple(dimensions)))
+        fig.canvas.draw()
+    with timed("encode", kind):
+        photo = figure_to_bytes(fig)
+    release_figure(fig)
+    return photo
+
+
+def draw_section_views(kind: str, dimensions: Tuple[float, ...], section: np.ndarray,
+                       views: Tuple[Tuple[float, float], ...]) -> List[bytes]:
+    if RENDER_BACKEND == "pillow":
+        return pillow_renderer.draw_section_views(kind, dimensions, section, views)
+    # сцена строится один раз, для каждого ракурса меняется только камера
+    ax, fig = build_solid(make_solid(kind, tuple(dimensions)))
+    add_section(ax, section)
+    photos = []
+    for azim, elev in views:
+        with timed("render", kind):
+            ax.view_init(elev=elev, azim=azim)
+            fig.canvas.draw()
+        with timed("encode", kind):
+            photos.append(figure_to_bytes(fig))
+    release_figure(fig)
+    return photos
+
+
+def draw_section(kind: str, dimensions: Tuple[float, ...], section: np.ndarray) -> bytes:
+    return draw_section_views(kind, dimensions, section, SECTION_VIEWS[:1])[0]
+
+
+def warm_up() -> None:
+    # импорт matplotlib и первая отрисовка (кэш шрифтов, холст Agg) стоят почти секунду,
+    # поэтому их лучше оплатить до первого запроса
+    draw_solid("tetrahedron", (1.0,))
+
+
+render_runner = None
+
+
+def set_render_runner(runner) -> None:
+    global render_runner
+    render_runner = runner
+
+
+# рендеры, которые уже выполняются: одновременные промахи по одному ключу ждут первый, а не рисуют ещё раз
+in_flight: Dict[str, Future] = {}
+in_flight_lock = threading.Lock()
+
+
+def single_flight(key: str, render, *args):
+    with in_flight_lock:
+        future = in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = in_flight[key] = Future()
+    if not owner:
+        return future.result()
+    try:
+        result = render(*args)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with in_flight_lock:
+            del in_flight[key]
+    future.set_result(result)
+    return result
+
+
+def cached_render(key: str, draw, *args) -> bytes:
+    photo = render_cache.get(key)
+    if photo is None:
+        photo = single_flight(key, render_and_cache, key, draw, *args)
+    return photo
+
+
+def render_and_cache(key: str, draw, *args) -> bytes:
+    # между промахом и регистрацией рендера тот же рисунок мог успеть закончить другой поток
+    photo = render_cache.peek(key)
+    if photo is None:
+        photo = draw(*args) if render_runner is None else render_runner(draw, *args)
+        render_cache.put(key, photo)
+    return photo
+
+
+def solid_key(kind: str, dimensions: Tuple[float, ...]) -> str:
+    return make_key(RENDER_BACKEND, encoding_key(), kind, *dimensions)
+
+
+def render_solid(kind: str, dimensions: Tuple[float, ...]) -> bytes:
+    return cached_render(solid_key(kind, dimensions), draw_solid, kind, tuple(dimensions))
+
+
+def lookup_solid(kind: str, dimensions: Tuple[float, ...]) -> Optional[bytes]:
+    # lookup_* принимают те же аргументы, что и render_*, и возвращают готовую картинку из кэша или None
+    return render_cache.peek(solid_key(kind, dimensions))
+
+
+def render_section(kind: str, dimensions: Tuple[float, ...],
+                   point_1: point, point_2: point, point_3: point) -> Tuple[bytes, Optional[str]]:
+    # геометрия считается здесь через общий кэш и уходит в рендер готовой, воркер её не пересчитывает
+    with timed("geometry", kind):
+        section = cached_section(kind, dimensions, point_1, point_2, point_3)
+        message = section_message(section)
+    key = section_view_key(kind, dimensions, canonical_plane(point_1, point_2, point_3), SECTION_VIEWS[0])
+    photo = cached_render(key, draw_section, kind, tuple(dimensions), section)
+    return photo, message
+
+
+def lookup_section(kind: str, dimensions: Tuple[float, ...],
+                   point_1: point, point_2: point, point_3: point) -> Optional[Tuple[bytes, Optional[str]]]:
+    key = section_view_key(kind, dimensions, canonical_plane(point_1, point_2, point_3), SECTION_VIEWS[0])
+    photo = render_cache.peek(key)
+    if photo is None:
+        return None
+    # подпись зависит только от геометрии, а она на порядки дешевле рендера и сама кэшируется
+    return photo, section_message(cached_section(kind, dimensions, point_1, point_2, point_3))
+
+
+def section_view_key(kind: str, dimensions: Tuple[float, ...], plane: Tuple[float, ...],
+                     view: Tuple[float, float]) -> str:
+    return make_key(RENDER_BACKEND, encoding_key(), kind, *dimensions, plane, tuple(view))
+
+
+def render_section_view(kind: str, dimensions: Tuple[float, ...],
+                        point_1: point, point_2: point, point_3: point, index: int) -> bytes:
+    plane = canonical_plane(point_1, point_2, point_3)
+    keys = [section_view_key(kind, dimensions, plane, view) for view in SECTION_VIEWS]
+    photo = render_cache.get(keys[index])
+    if photo is None:
+        # один рендер ракурсов на плоскость: предрендер и нажатие на поворот не рисуют их параллельно
+        args = (kind, dimensions, point_1, point_2, point_3, keys)
+        photos = single_flight("views:" + keys[0], render_missing_views, *args)
+        photo = photos.get(index) or render_cache.peek(keys[index]) or render_missing_views(*args)[index]
+    return photo
+
+
+def render_missing_views(kind: str, dimensions: Tuple[float, ...], point_1: point, point_2: point, point_3: point,
+                         keys: List[str]) -> Dict[int, bytes]:
+    # при промахе рисуем за один проход все ракурсы, которых нет в кэше; первый обычно уже нарисован
+    # вместе с сечением, следующие повороты берутся из кэша
+    missing = [i for i, key in enumerate(keys) if not render_cache.contains(key)]
+    if not missing:
+        return {}
+    section = cached_section(kind, dimensions, point_1, point_2, point_3)
+    args = (kind, tuple(dimensions), section, tuple(SECTION_VIEWS[i] for i in missing))
+    photos = draw_section_views(*args) if render_runner is None else render_runner(draw_section_views, *args)
+    for i, view_photo in zip(missing, photos):
+        render_cache.put(keys[i], view_photo)
+    return dict(zip(missing, photos))
+
+
+def lookup_section_view(kind: str, dimensions: Tuple[float, ...],
+                        point_1: point, point_2: point, point_3: point, index: int) -> Optional[bytes]:
+    plane = canonical_plane(point_1, point_2, point_3)
+    return render_cache.peek(section_view_key(kind, dimensions, plane, SECTION_VIEWS[index]))
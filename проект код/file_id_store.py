@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from typing import Optional
+
+from telebot import types
+from telebot.asyncio_helper import ApiTelegramException
+
+
+class FileIdStore:
+    # get/put/forget синхронные и берут блокировку, из корутин они вызываются через asyncio.to_thread:
+    # commit в sqlite ждёт диска и остановил бы цикл событий вместе со всеми чатами
+    def __init__(self, path: str = ":memory:"):
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.uploaded_bytes = 0
+        self.saved_bytes = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS file_ids "
+                                 "(image_hash TEXT PRIMARY KEY, file_id TEXT NOT NULL)")
+        self._connection.commit()
+
+    @staticmethod
+    def image_hash(photo: bytes) -> str:
+        return hashlib.sha256(photo).hexdigest()
+
+    def get(self, image_hash: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute("SELECT file_id FROM file_ids WHERE image_hash = ?",
+                                           (image_hash,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, image_hash: str, file_id: str) -> None:
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO file_ids (image_hash, file_id) VALUES (?, ?)",
+                                     (image_hash, file_id))
+            self._connection.commit()
+
+    def forget(self, image_hash: str) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM file_ids WHERE image_hash = ?", (image_hash,))
+            self._connection.commit()
+
+    async def send_photo(self, bot, chat_id: int, photo: bytes, **kwargs) -> types.Message:
+        image_hash = self.image_hash(photo)
+        file_id = await asyncio.to_thread(self.get, image_hash)
+        if file_id is not None:
+            try:
+                msg = await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+                self.hits += 1
+                self.saved_bytes += len(photo)
+                return msg
+            except ApiTelegramException as e:
+                # file_id мог устареть или принадлежать другому боту, тогда загружаем картинку заново
+                if e.error_code != 400:
+                    raise
+                self.stale += 1
+                await asyncio.to_thread(self.forget, image_hash)
+
+        self.misses += 1
+        msg = await bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+        self.uploaded_bytes += len(photo)
+        if msg.photo:
+            await asyncio.to_thread(self.put, image_hash, msg.photo[-1].file_id)
+        return msg
+
+    async def edit_photo(self, bot, chat_id: int, message_id: int, photo: bytes, caption: Optional[str] = None,
+                         reply_markup=None) -> Optional[types.Message]:
+        image_hash = self.image_hash(photo)
+        file_id = await asyncio.to_thread(self.get, image_hash)
+        if file_id is not None:
+            try:
+                msg = await bot.edit_message_media(media=types.InputMediaPhoto(file_id, caption=caption),
+                                                   chat_id=chat_id, message_id=message_id,
+                                                   reply_markup=reply_markup)
+                self.hits += 1
+                self.saved_bytes += len(photo)
+                return msg
+            except ApiTelegramException as e:
+                if e.error_code != 400:
+                    raise
+                # повторное нажатие той же кнопки: картинка уже на месте
+                if "message is not modified" in e.description:
+                    return None
+                self.stale += 1
+                await asyncio.to_thread(self.forget, image_hash)
+
+        self.misses += 1
+        msg = await bot.edit_message_media(media=types.InputMediaPhoto(photo, caption=caption),
+                                           chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+        self.uploaded_bytes += len(photo)
+        if isinstance(msg, types.Message) and msg.photo:
+            await asyncio.to_thread(self.put, image_hash, msg.photo[-1].file_id)
+        return msg
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM file_ids").fetchone()[0]
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "uploaded_bytes": self.uploaded_bytes,
+            "saved_bytes": self.saved_bytes,
+        }
@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from config import IMAGE_FORMAT, IMAGE_SIZE, IMAGE_DPI, IMAGE_COLORS, IMAGE_QUALITY, PNG_COMPRESS_LEVEL
+
+logger = logging.getLogger(__name__)
+
+formats = ("png", "jpeg", "webp", "svg")
+extensions = {"png": "png", "jpeg": "jpg", "webp": "webp", "svg": "svg"}
+
+
+class EncodeStats:
+    def __init__(self):
+        self.images = 0
+        self.encoded_bytes = 0
+        self.seconds = 0.0
+        self.last: Optional[Tuple[str, int, float]] = None
+
+        self._lock = threading.Lock()
+        # в процессе-воркере записи копятся здесь и уходят родителю вместе с результатом, как замеры metrics
+        self._collected: Optional[list] = None
+
+    def record(self, fmt: str, size: int, seconds: float) -> None:
+        if self._collected is not None:
+            self._collected.append((fmt, size, seconds))
+            return
+        with self._lock:
+            self.images += 1
+            self.encoded_bytes += size
+            self.seconds += seconds
+            self.last = (fmt, size, seconds)
+        logger.info("Изображение %s: %d байт за %.1f мс", fmt, size, seconds * 1000)
+
+    def call_collecting(self, fn, *args):
+        self._collected = []
+        try:
+            result = fn(*args)
+            return result, self._collected
+        finally:
+            self._collected = None
+
+    def merge(self, records: List[Tuple[str, int, float]]) -> None:
+        for fmt, size, seconds in records:
+            self.record(fmt, size, seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "images": self.images,
+                "encoded_bytes": self.encoded_bytes,
+                "seconds": self.seconds,
+                "last": self.last,
+            }
+
+
+encode_stats = EncodeStats()
+
+
+def figure_size() -> Tuple[float, float]:
+    return IMAGE_SIZE[0] / IMAGE_DPI, IMAGE_SIZE[1] / IMAGE_DPI
+
+
+def encoding_key() -> tuple:
+    # настройки, от которых зависят байты картинки, входят в ключ кэша рендеров
+    return IMAGE_FORMAT, IMAGE_SIZE, IMAGE_DPI, IMAGE_COLORS, IMAGE_QUALITY, PNG_COMPRESS_LEVEL
+
+
+def file_name(data: bytes, stem: str = "section") -> str:
+    if data[:4] == b"\x89PNG":
+        fmt = "png"
+    elif data[:3] == b"\xff\xd8\xff":
+        fmt = "jpeg"
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        fmt = "webp"
+    else:
+        fmt = "svg"
+    return f"{stem}.{extensions[fmt]}"
+
+
+def is_svg(data: bytes) -> bool:
+    return file_name(data).endswith(".svg")
+
+
+def _save(image: Image.Image, fmt: str, buf: BytesIO) -> None:
+    if fmt == "jpeg":
+        image.convert("RGB").save(buf, format="JPEG", quality=IMAGE_QUALITY, optimize=True)
+    elif fmt == "webp":
+        image.save(buf, format="WEBP", quality=IMAGE_QUALITY, method=4)
+    else:
+        if IMAGE_COLORS:
+            # картинки почти целиком из плоских заливок, палитры хватает, а PNG получается в разы меньше
+            image = image.quantize(colors=IMAGE_COLORS, method=Image.Quantize.MAXCOVERAGE, dither=Image.Dither.NONE)
+        image.save(buf, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+
+
+def encode_image(image: Image.Image, fmt: str = IMAGE_FORMAT) -> bytes:
+    # Pillow не умеет векторный вывод, поэтому вместо SVG отдаём PNG
+    fmt = "png" if fmt == "svg" else fmt
+    start = time.perf_counter()
+    buf = BytesIO()
+    _save(image, fmt, buf)
+    data = buf.getvalue()
+    encode_stats.record(fmt, len(data), time.perf_counter() - start)
+    return data
+
+
+def encode_figure(fig, fmt: str = IMAGE_FORMAT) -> bytes:
+    buf = BytesIO()
+    if fmt == "svg":
+        start = time.perf_counter()
+        fig.savefig(buf, format="svg")
+    else:
+        # растр берём прямо с холста Agg: это дешевле, чем savefig, и даёт одну точку настройки сжатия
+        if fig.stale:
+            fig.canvas.draw()
+        start = time.perf_counter()
+        image = Image.fromarray(np.asarray(fig.canvas.buffer_rgba())[:, :, :3])
+        _save(image, fmt, buf)
+    data = buf.getvalue()
+    encode_stats.record(fmt, len(data), time.perf_counter() - start)
+    return data
@@ -18,3 +18,14 @@ def yes_no_kb() -> types.ReplyKeyboardMarkup:
     no = types.KeyboardButton(text="Нет ❌")
     kb.row(no, yes)
     return kb
+
+
+def section_kb(view: int = 0, views: int = 1) -> types.InlineKeyboardMarkup:
+    kb = types.InlineKeyboardMarkup()
+    if views > 1:
+        left = types.InlineKeyboardButton(text="⟲ Повернуть", callback_data=f"view:{(view - 1) % views}")
+        right = types.InlineKeyboardButton(text="Повернуть ⟳", callback_data=f"view:{(view + 1) % views}")
+        kb.row(left, right)
+    sweep = types.InlineKeyboardButton(text="▶️ Анимация сечения", callback_data="sweep")
+    kb.row(sweep)
+    return kb
@@ -5,5 +5,9 @@ def select_figure() -> types.ReplyKeyboardMarkup:
     kb = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
     tetrahedron = types.KeyboardButton(text="Тетраэдр")
     parallelepiped = types.KeyboardButton(text="Параллелепипед")
+    octahedron = types.KeyboardButton(text="Октаэдр")
+    pyramid = types.KeyboardButton(text="Пирамида")
+    prism = types.KeyboardButton(text="Призма")
     kb.row(tetrahedron, parallelepiped)
+    kb.row(octahedron, pyramid, prism)
     return kb
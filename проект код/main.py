@@ -1,4 +1,34 @@
-from bot import bot
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    # импорты бота здесь, а не на уровне модуля: воркеры forkserver и spawn заново импортируют __main__,
+    # и иначе каждый из них тянул бы telebot, aiohttp, sqlite-хранилища и сессию Bot API
+    started = time.perf_counter()
+    from bot import bot, render_service
+    import metrics
+    from config import (WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_BATCH_SIZE,
+                        METRICS_HOST, METRICS_PORT)
+    from webhook import run_webhook
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    render_service.start()
+    if metrics.enabled:
+        metrics.start_server(METRICS_HOST, METRICS_PORT)
+    logger.info("Бот запущен за %.0f мс", (time.perf_counter() - started) * 1000)
+    try:
+        if WEBHOOK_URL:
+            asyncio.run(run_webhook(bot, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+                                    WEBHOOK_BATCH_SIZE))
+        else:
+            asyncio.run(bot.infinity_polling())
+    finally:
+        render_service.shutdown()
+
 
 if __name__ == "__main__":
-    bot.infinity_polling()
+    main()
@@ -0,0 +1,110 @@
+import gc
+import os
+import resource
+import threading
+import time
+import tracemalloc
+import weakref
+from typing import List, Optional
+
+from config import MEMORY_MAX_LIVE_FIGURES
+
+_page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_figures = weakref.WeakSet()
+
+
+def rss() -> int:
+    # текущий RSS из /proc; где его нет (macOS), берём пиковый - он тоже растёт при утечке
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * _page_size
+    except (OSError, IndexError, ValueError):
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if os.uname().sysname == "Darwin" else maxrss * 1024
+
+
+def track_figure(fig) -> None:
+    # фигура считается, пока её не освободил сборщик мусора; счётчик, который растёт и не спадает, - утечка
+    _figures.add(fig)
+
+
+def live_figures() -> int:
+    return len(_figures)
+
+
+def collect_figures() -> None:
+    # у фигуры matplotlib циклические ссылки, её освобождает только полная сборка мусора,
+    # а до неё может дойти не скоро; полная сборка стоит ~50 мс, поэтому только по порогу
+    if MEMORY_MAX_LIVE_FIGURES and live_figures() > MEMORY_MAX_LIVE_FIGURES:
+        gc.collect()
+
+
+def usage() -> dict:
+    return {"pid": os.getpid(), "rss": rss(), "figures": live_figures()}
+
+
+class Snapshots:
+    # снимки tracemalloc по запросу оператора: трассировка включается только на время расследования,
+    # потому что замедляет каждое выделение памяти
+    def __init__(self, frames: int, top: int):
+        self.frames = frames
+        self.top = top
+        self.taken = 0
+
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._baseline_time = 0.0
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> str:
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self._baseline = None
+            gc.collect()
+            snapshot = self._take()
+            lines = self._diff(snapshot) if self._baseline is not None else self._top(snapshot)
+            self._baseline = snapshot
+            self._baseline_time = time.time()
+            self.taken += 1
+            return "\n".join(lines) + "\n"
+
+    def stop(self) -> str:
+        with self._lock:
+            tracemalloc.stop()
+            self._baseline = None
+            return "Трассировка выделений памяти остановлена\n"
+
+    def _take(self) -> tracemalloc.Snapshot:
+        # выделения самого tracemalloc и импортов в отчёте не нужны
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+
+    def _top(self, snapshot: tracemalloc.Snapshot) -> List[str]:
+        stats = snapshot.statistics("traceback")
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Первый снимок: отслеживается {current} байт (пик {peak}). "
+                 f"Следующий запрос покажет разницу с этим снимком.", ""]
+        for stat in stats[:self.top]:
+            lines.append(f"{stat.size} байт в {stat.count} блоках")
+            lines.extend(f"    {line}" for line in stat.traceback.format())
+        return lines
+
+    def _diff(self, snapshot: tracemalloc.Snapshot) -> List[str]:
+        stats = snapshot.compare_to(self._baseline, "traceback")
+        lines = [f"Разница со снимком {time.time() - self._baseline_time:.0f} с назад, "
+                 f"всего {sum(stat.size_diff for stat in stats):+d} байт", ""]
+        for stat in stats[:self.top]:
+            lines.append(f"{stat.size_diff:+d} байт ({stat.count_diff:+d} блоков), сейчас {stat.size} байт")
+            lines.extend(f"    {line}" for line in stat.traceback.format())
+        return lines
+
+    def stats(self) -> dict:
+        tracing = tracemalloc.is_tracing()
+        return {
+            "tracing": tracing,
+            "traced_bytes": tracemalloc.get_traced_memory()[0] if tracing else 0,
+            "snapshots": self.taken,
+        }
@@ -0,0 +1,170 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import METRICS_ENABLED, METRICS_WINDOW
+
+logger = logging.getLogger(__name__)
+
+prefix = "section_bot"
+quantiles = (0.5, 0.95, 0.99)
+
+enabled = METRICS_ENABLED
+
+
+class Summary:
+    # квантили считаются по последним window замерам, сумма и счётчик - за всё время
+    def __init__(self, window: int):
+        self.samples = deque(maxlen=window)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.sum += seconds
+        self.count += 1
+
+    def quantiles(self) -> List[Tuple[float, float]]:
+        samples = sorted(self.samples)
+        if not samples:
+            return []
+        return [(q, samples[min(int(q * len(samples)), len(samples) - 1)]) for q in quantiles]
+
+
+_summaries: Dict[Tuple[str, str], Summary] = {}
+_sources: Dict[str, Callable[[], dict]] = {}
+# дополнительные страницы сервера метрик для операторов (GET) и действия, меняющие состояние процесса (POST):
+# GET по ссылке может сделать кто угодно - сборщик метрик, превью ссылок в мессенджере
+_pages: Dict[str, Callable[[], str]] = {}
+_actions: Dict[str, Callable[[], str]] = {}
+_lock = threading.Lock()
+# в процессе-воркере замеры не попадают в общий реестр, а копятся здесь и уходят в ответе (см. call_collecting)
+_collected: Optional[list] = None
+
+
+class _Timer:
+    __slots__ = ("stage", "solid", "start")
+
+    def __init__(self, stage: str, solid: str):
+        self.stage = stage
+        self.solid = solid
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.stage, self.solid, time.perf_counter() - self.start)
+        return False
+
+
+_disabled = nullcontext()
+
+
+def timed(stage: str, solid: Optional[str]):
+    if not enabled:
+        return _disabled
+    return _Timer(stage, solid or "")
+
+
+def observe(stage: str, solid: str, seconds: float) -> None:
+    if not enabled:
+        return
+    if _collected is not None:
+        _collected.append((stage, solid, seconds))
+        return
+    with _lock:
+        summary = _summaries.get((stage, solid))
+        if summary is None:
+            summary = _summaries[(stage, solid)] = Summary(METRICS_WINDOW)
+        summary.observe(seconds)
+    logger.info("stage=%s solid=%s ms=%.2f", stage, solid, seconds * 1000)
+
+
+def call_collecting(fn, *args):
+    # родитель просит замеры, только когда метрики у него включены, так что включаем их и в воркере
+    global _collected, enabled
+    enabled = True
+    _collected = []
+    try:
+        result = fn(*args)
+        return result, _collected
+    finally:
+        _collected = None
+
+
+def merge(samples: List[Tuple[str, str, float]]) -> None:
+    for stage, solid, seconds in samples:
+        observe(stage, solid, seconds)
+
+
+def register(name: str, stats: Callable[[], dict]) -> None:
+    _sources[name] = stats
+
+
+def add_page(path: str, page: Callable[[], str]) -> None:
+    _pages[path] = page
+
+
+def add_action(path: str, action: Callable[[], str]) -> None:
+    _actions[path] = action
+
+
+def render_text() -> str:
+    lines = [f"# TYPE {prefix}_stage_seconds summary"]
+    with _lock:
+        summaries = [(key, summary.quantiles(), summary.sum, summary.count)
+                     for key, summary in sorted(_summaries.items())]
+    for (stage, solid), stage_quantiles, total, count in summaries:
+        labels = f'stage="{stage}",solid="{solid}"'
+        for q, value in stage_quantiles:
+            lines.append(f'{prefix}_stage_seconds{{{labels},quantile="{q}"}} {value:.6f}')
+        lines.append(f"{prefix}_stage_seconds_sum{{{labels}}} {total:.6f}")
+        lines.append(f"{prefix}_stage_seconds_count{{{labels}}} {count}")
+
+    for name, stats in sorted(_sources.items()):
+        for key, value in stats().items():
+            # bool - тоже int, готовность отдаём как 0/1
+            if isinstance(value, (int, float)):
+                lines.append(f"# TYPE {prefix}_{name}_{key} gauge")
+                lines.append(f"{prefix}_{name}_{key} {int(value) if isinstance(value, bool) else value}")
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self._respond(render_text if self.path == "/metrics" else _pages.get(self.path), "POST", _actions)
+
+    def do_POST(self):
+        self._respond(_actions.get(self.path), "GET", _pages)
+
+    def _respond(self, page, other_method: str, other: dict):
+        if page is None:
+            if self.path in other:
+                self.send_response(405)
+                self.send_header("Allow", other_method)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            else:
+                self.send_error(404)
+            return
+        body = page().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host: str, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Метрики доступны на http://%s:%d/metrics", host, port)
+    return server
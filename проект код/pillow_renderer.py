@@ -0,0 +1,105 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from config import IMAGE_SIZE
+from image_encoding import encode_image
+from metrics import timed
+from solid_geometry import ConvexPolyhedron, make_solid
+
+face_colors = ((0, 255, 255, 13), (255, 0, 255, 13))
+section_color = (255, 0, 0, 102)
+edge_color = (0, 0, 0, 255)
+axis_color = (128, 128, 128, 255)
+
+
+class Camera:
+    def __init__(self, vertices: np.ndarray, size: Tuple[int, int], azim: float = -60, elev: float = 30,
+                 margin: float = 0.12):
+        azim, elev = np.deg2rad(azim), np.deg2rad(elev)
+        # как и в build_figure: ось X подписана как Y, ось Y как X и инвертирована
+        flip = np.diag([1.0, -1.0, 1.0])
+        right = np.array([-np.sin(azim), np.cos(azim), 0])
+        up = np.array([-np.sin(elev) * np.cos(azim), -np.sin(elev) * np.sin(azim), np.cos(elev)])
+        eye = np.array([np.cos(elev) * np.cos(azim), np.cos(elev) * np.sin(azim), np.sin(elev)])
+        self.matrix = np.stack([right, -up, eye]) @ flip
+
+        corners = np.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], dtype=float)
+        low, high = np.minimum(vertices.min(axis=0), 0), vertices.max(axis=0)
+        box = (corners * (high - low) + low) @ self.matrix[:2].T
+        width, height = size
+        self.scale = (1 - 2 * margin) * min(width / np.ptp(box[:, 0]), height / np.ptp(box[:, 1]))
+        self.offset = np.array([width, height]) / 2 - self.scale * (box.min(axis=0) + box.max(axis=0)) / 2
+
+    def project(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        camera = points @ self.matrix.T
+        return camera[:, :2] * self.scale + self.offset, camera[:, 2]
+
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def draw_scene(solid: ConvexPolyhedron, section: Optional[np.ndarray] = None, size: Tuple[int, int] = IMAGE_SIZE,
+               supersample: int = 2, azim: float = -60, elev: float = 30) -> Image.Image:
+    # рисуем в увеличенном масштабе и усредняем блоки пикселей при уменьшении - это и есть сглаживание
+    width, height = size[0] * supersample, size[1] * supersample
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image, "RGBA")
+
+    vertices = solid.get_vertices()
+    camera = Camera(vertices, (width, height), azim, elev)
+
+    extent = vertices.max(axis=0)
+    axes = np.array([[0, 0, 0], [extent[0], 0, 0], [0, extent[1], 0], [0, 0, extent[2]]]) * 1.15
+    axes_2d, _ = camera.project(axes)
+    font = _font(14 * supersample)
+    for end, label in zip(axes_2d[1:], ("Y", "X", "Z")):
+        draw.line([tuple(axes_2d[0]), tuple(end)], fill=axis_color, width=supersample)
+        draw.text(tuple(end), label, fill=edge_color, font=font)
+
+    projected, depth = camera.project(vertices)
+    faces = solid.get_faces()
+    # грани от дальних к ближним, чтобы полупрозрачные заливки накладывались правильно
+    for i in sorted(range(len(faces)), key=lambda f: depth[faces[f]].mean()):
+        draw.polygon([tuple(projected[v]) for v in faces[i]], fill=face_colors[i % len(face_colors)])
+
+    if section is not None and len(section) != 0:
+        section_2d, _ = camera.project(section)
+        if len(section) >= 3:
+            draw.polygon([tuple(p) for p in section_2d], fill=section_color)
+        radius = 3 * supersample
+        for x, y in section_2d:
+            draw.ellipse([x - radius, y - radius, x + radius, y + radius], fill=(255, 0, 0, 255))
+
+    for v1, v2 in solid.edge_index:
+        draw.line([tuple(projected[v1]), tuple(projected[v2])], fill=edge_color, width=supersample)
+
+    return image.reduce(supersample) if supersample > 1 else image
+
+
+def image_to_bytes(image: Image.Image) -> bytes:
+    return encode_image(image)
+
+
+def draw_solid(kind: str, dimensions: Tuple[float, ...]) -> bytes:
+    with timed("render", kind):
+        image = draw_scene(make_solid(kind, tuple(dimensions)))
+    with timed("encode", kind):
+        return image_to_bytes(image)
+
+
+def draw_section_views(kind: str, dimensions: Tuple[float, ...], section: np.ndarray,
+                       views: Tuple[Tuple[float, float], ...]) -> List[bytes]:
+    solid = make_solid(kind, tuple(dimensions))
+    photos = []
+    for azim, elev in views:
+        with timed("render", kind):
+            image = draw_scene(solid, section, azim=azim, elev=elev)
+        with timed("encode", kind):
+            photos.append(image_to_bytes(image))
+    return photos
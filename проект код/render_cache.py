@@ -0,0 +1,169 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+
+def make_key(*parts) -> str:
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+class RenderCache:
+    def __init__(self, max_bytes: int, directory: Optional[str] = None, disk_max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.size = 0
+        self.disk_size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.disk_size = sum(size for _, size, _ in self._disk_files())
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self.peek(key)
+        if data is None:
+            with self._lock:
+                self.misses += 1
+        return data
+
+    def contains(self, key: str) -> bool:
+        # проверка без чтения данных и без влияния на статистику и порядок вытеснения
+        with self._lock:
+            if key in self._entries:
+                return True
+        return bool(self.directory) and os.path.exists(self._path(key))
+
+    def peek(self, key: str) -> Optional[bytes]:
+        # как get, но промах не учитывается: после него тот же ключ запросит сам рендер
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+
+        data = self._read_disk(key)
+        if data is None:
+            return None
+        with self._lock:
+            self.disk_hits += 1
+            self._store(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        with self._lock:
+            self._store(key, data)
+        self._write_disk(key, data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_bytes": self.disk_size,
+                "disk_max_bytes": self.disk_max_bytes or 0,
+                "disk_evictions": self.disk_evictions,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _store(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            # время изменения служит временем последнего обращения: atime часто отключён (noatime)
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        if not self.directory:
+            return
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # запись через временный файл, чтобы другой процесс не прочитал половину картинки
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._disk_lock:
+            self.disk_size += len(data)
+            if self.disk_max_bytes and self.disk_size > self.disk_max_bytes:
+                self._evict_disk()
+
+    def _disk_files(self) -> List[Tuple[float, int, str]]:
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            for file in os.scandir(entry.path):
+                if file.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = file.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file.path))
+        return files
+
+    def _evict_disk(self) -> None:
+        # каталог пересчитывается целиком: так размер не расходится с диском, даже если файлы удаляли вручную.
+        # Удаляем самые давние до 90% бюджета, чтобы не сканировать каталог на каждой записи
+        files = sorted(self._disk_files())
+        self.disk_size = sum(size for _, size, _ in files)
+        target = self.disk_max_bytes * 0.9
+        for _, size, path in files:
+            if self.disk_size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.disk_size -= size
+            self.disk_evictions += 1
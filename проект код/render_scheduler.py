@@ -0,0 +1,199 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional
+
+import metrics
+from render_service import RenderBusy
+
+
+class RenderSuperseded(Exception):
+    pass
+
+
+class _Job:
+    __slots__ = ("group", "fn", "args", "background", "solid", "future", "queued", "throttled")
+
+    def __init__(self, group: str, fn, args: tuple, background: bool, solid: Optional[str], future: asyncio.Future):
+        self.group = group
+        self.fn = fn
+        self.args = args
+        self.background = background
+        self.solid = solid
+        self.future = future
+        self.queued = time.monotonic()
+        self.throttled = False
+
+
+class _Chat:
+    __slots__ = ("tokens", "updated", "jobs", "running")
+
+    def __init__(self, tokens: float):
+        self.tokens = tokens
+        self.updated = time.monotonic()
+        self.jobs: Deque[_Job] = deque()
+        # группа выполняющейся задачи, None - чат ничего не рендерит
+        self.running: Optional[str] = None
+
+
+class RenderScheduler:
+    # рендеры выполняются по кругу между чатами, у каждого чата не больше одного рендера одновременно
+    # и свой бакет токенов; новый запрос вытесняет ещё не начатый запрос того же чата из той же группы.
+    # Фоновые задачи не тратят токены и занимают воркер, только когда никто из пользователей не ждёт.
+    # Ожидающих задач не больше max_pending на чат и не больше queue_size всего, сверх этого - RenderBusy.
+    # Картинка, которая уже есть в кэше (cached), отдаётся сразу: без очереди и без списания токенов
+    def __init__(self, concurrency: int, rate: Optional[float], burst: float, max_pending: int, queue_size: int):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_pending = max_pending
+        self.queue_size = queue_size
+        self.completed = 0
+        self.superseded = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.cache_hits = 0
+
+        self._chats: Dict[int, _Chat] = {}
+        # чаты с ожидающими задачами в порядке очереди, выполняющиеся чаты сюда не входят
+        self._ready: OrderedDict = OrderedDict()
+        self._running = 0
+        self._pending = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._sweep_at = 1024
+
+    async def run(self, chat_id: int, group: str, fn, *args, cached=None, background: bool = False,
+                  solid: Optional[str] = None):
+        # cached(*args) возвращает готовый результат или None, тогда fn(*args) ставится в очередь
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if len(self._chats) >= self._sweep_at:
+                self._forget_idle()
+            chat = self._chats[chat_id] = _Chat(self.burst)
+        # пока рендерится задача той же группы, попадание ждёт её, иначе старый результат придёт позже нового
+        result = cached(*args) if cached is not None and chat.running != group else None
+        self._supersede(chat, group, background)
+        if result is not None:
+            self.cache_hits += 1
+            return result
+        if len(chat.jobs) >= self.max_pending or self._pending >= self.queue_size:
+            self.rejected += 1
+            raise RenderBusy
+
+        job = _Job(group, fn, args, background, solid, asyncio.get_running_loop().create_future())
+        chat.jobs.append(job)
+        self._pending += 1
+        if not chat.running and chat_id not in self._ready:
+            self._ready[chat_id] = None
+        self._dispatch()
+        return await job.future
+
+    def _supersede(self, chat: _Chat, group: str, background: bool) -> None:
+        # фоновая задача вытесняет только фоновую: пользовательский запрос не должен пропасть из-за предрендера
+        for job in chat.jobs:
+            if job.group == group and (job.background or not background):
+                chat.jobs.remove(job)
+                self._pending -= 1
+                if not job.future.done():
+                    job.future.set_exception(RenderSuperseded())
+                self.superseded += 1
+                break
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        wake = None
+        for background in (False, True):
+            for chat_id in list(self._ready):
+                if self._running >= self.concurrency:
+                    break
+                chat = self._chats[chat_id]
+                # задачи, которые уже никто не ждёт, выбрасываются без списания токенов
+                if any(job.future.done() for job in chat.jobs):
+                    jobs = len(chat.jobs)
+                    chat.jobs = deque(job for job in chat.jobs if not job.future.done())
+                    self._pending -= jobs - len(chat.jobs)
+                if not chat.jobs:
+                    del self._ready[chat_id]
+                    continue
+                # фоновая задача в начале очереди чата не задерживает пользовательскую, стоящую за ней;
+                # фоновая запускается, только когда у чата не осталось пользовательских
+                job = next((job for job in chat.jobs if not job.background), None)
+                if (job is None) != background:
+                    continue
+                if job is None:
+                    job = chat.jobs[0]
+                if self.rate and not background:
+                    chat.tokens = min(self.burst, chat.tokens + (now - chat.updated) * self.rate)
+                    chat.updated = now
+                    if chat.tokens < 1:
+                        if not job.throttled:
+                            job.throttled = True
+                            self.throttled += 1
+                        wait = (1 - chat.tokens) / self.rate
+                        wake = wait if wake is None else min(wake, wait)
+                        continue
+                    chat.tokens -= 1
+                chat.jobs.remove(job)
+                self._pending -= 1
+                del self._ready[chat_id]
+                self._start(chat_id, chat, job, now)
+        if wake is not None:
+            self._wake_in(wake)
+
+    def _start(self, chat_id: int, chat: _Chat, job: _Job, now: float) -> None:
+        chat.running = job.group
+        self._running += 1
+        metrics.observe("queue", job.solid or "", now - job.queued)
+        task = asyncio.ensure_future(asyncio.to_thread(job.fn, *job.args))
+        task.add_done_callback(lambda t: self._finish(chat_id, chat, job, t))
+
+    def _finish(self, chat_id: int, chat: _Chat, job: _Job, task: asyncio.Future) -> None:
+        chat.running = None
+        self._running -= 1
+        self.completed += 1
+        if not job.future.done():
+            if task.cancelled():
+                job.future.cancel()
+            elif task.exception() is not None:
+                job.future.set_exception(task.exception())
+            else:
+                job.future.set_result(task.result())
+        if chat.jobs:
+            # чат встаёт в конец круга, даже если у него ещё есть задачи
+            self._ready[chat_id] = None
+        self._dispatch()
+
+    def _wake_in(self, delay: float) -> None:
+        loop = asyncio.get_running_loop()
+        if self._timer is not None:
+            if self._timer.when() <= loop.time() + delay:
+                return
+            self._timer.cancel()
+        self._timer = loop.call_later(delay, self._wake)
+
+    def _wake(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    def _forget_idle(self) -> None:
+        # чат без задач с полным бакетом ничем не отличается от нового, его можно забыть
+        now = time.monotonic()
+        for chat_id, chat in list(self._chats.items()):
+            if (not chat.jobs and not chat.running
+                    and (not self.rate or chat.tokens + (now - chat.updated) * self.rate >= self.burst)):
+                del self._chats[chat_id]
+        self._sweep_at = max(1024, 2 * len(self._chats))
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "running": self._running,
+            "pending": self._pending,
+            "queue_size": self.queue_size,
+            "chats": len(self._chats),
+            "completed": self.completed,
+            "superseded": self.superseded,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+            "cache_hits": self.cache_hits,
+        }
@@ -0,0 +1,223 @@
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+
+import memory
+import metrics
+from image_encoding import encode_stats
+
+
+logger = logging.getLogger(__name__)
+
+
+class RenderBusy(Exception):
+    pass
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+def _warm_up() -> None:
+    # импорт matplotlib и первая отрисовка происходят при старте воркера, а не на запросе первого пользователя
+    from figure_builder import warm_up
+    warm_up()
+
+
+def _ping() -> bool:
+    return True
+
+
+def _call(fn, args: tuple, collect_metrics: bool):
+    if collect_metrics:
+        # замеры этапов внутри воркера возвращаются вместе с результатом
+        return metrics.call_collecting(fn, *args)
+    return fn(*args), None
+
+
+def _run_job(fn, args: tuple, collect_metrics: bool):
+    # вместе с результатом воркер сообщает свою память, по ней родитель решает, не пора ли сменить пул,
+    # и размеры закодированных картинок: счётчики кодирования в памяти воркера родитель не видит
+    (result, samples), encoded = encode_stats.call_collecting(_call, fn, args, collect_metrics)
+    memory.collect_figures()
+    return result, samples, encoded, memory.usage()
+
+
+class RenderService:
+    def __init__(self, workers: int, queue_size: int, timeout: float, start_method: str = "forkserver",
+                 warm_up: str = "background", recycle_after: Optional[int] = None,
+                 max_worker_rss: Optional[int] = None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.start_method = start_method
+        self.warm_up = warm_up
+        # воркеры перезапускаются сменой всего пула, а не через max_tasks_per_child:
+        # в Python 3.11 с ним ProcessPoolExecutor зависает, когда воркер уходит на замену
+        self.recycle_after = recycle_after
+        self.max_worker_rss = max_worker_rss
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.recycles = 0
+        self.crashes = 0
+        self.ready = threading.Event()
+        self.warm_up_seconds: Optional[float] = None
+
+        self._executor = None
+        self._context = None
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._swap_lock = threading.Lock()
+        self._generation_jobs = 0
+        # последняя сводка памяти каждого воркера: pid -> (rss, живые фигуры, время)
+        self._worker_memory: Dict[int, Tuple[int, int, float]] = {}
+
+    def start(self) -> None:
+        started = time.perf_counter()
+        lazy = self.warm_up == "lazy"
+        if self.workers > 0:
+            self._context = multiprocessing.get_context(self.start_method)
+            if self.start_method == "forkserver":
+                preload = ["figure_builder"]
+                if not lazy:
+                    preload += ["matplotlib.figure", "matplotlib.backends.backend_agg", "mpl_toolkits.mplot3d"]
+                self._context.set_forkserver_preload(preload)
+            self._executor = self._make_executor()
+        if lazy:
+            # ready не выставляется: воркеры запустятся и прогреются только на первых запросах
+            return
+
+        def wait_ready() -> None:
+            if self.workers == 0:
+                _warm_up()
+                return
+            # пул создаёт процессы по мере поступления задач, поэтому сразу занимаем все воркеры;
+            # первый submit ждёт, пока forkserver импортирует preload, так что это тоже делается здесь
+            self._ping_all(self._executor)
+
+        if self.warm_up == "blocking":
+            self._set_ready(wait_ready, started)
+        else:
+            threading.Thread(target=self._set_ready, args=(wait_ready, started), name="render-warm-up",
+                             daemon=True).start()
+
+    def _make_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context,
+                                   initializer=None if self.warm_up == "lazy" else _warm_up)
+
+    def _ping_all(self, executor: ProcessPoolExecutor) -> None:
+        futures = [executor.submit(_ping) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def _set_ready(self, wait_ready, started: float) -> None:
+        try:
+            wait_ready()
+        except Exception:
+            logger.exception("Не удалось прогреть рендер")
+            return
+        self.warm_up_seconds = time.perf_counter() - started
+        self.ready.set()
+        logger.info("Рендер готов через %.0f мс (%s)", self.warm_up_seconds * 1000, self.warm_up)
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
+            self._executor = None
+
+    def run(self, fn, *args):
+        # воркер, убитый OOM killer'ом или сигналом, ломает весь пул: каждая следующая задача получила бы
+        # BrokenProcessPool. Пул меняется целиком, а задача повторяется один раз уже в новом
+        for _ in range(2):
+            executor = self._executor
+            try:
+                return self._run_in(executor, fn, args)
+            except BrokenProcessPool:
+                self.crashes += 1
+                self.recycle(executor, "воркер завершился аварийно")
+        raise RenderBusy
+
+    def _run_in(self, executor: ProcessPoolExecutor, fn, args: tuple):
+        # слот освобождается только когда задача действительно завершилась в воркере,
+        # иначе задачи, брошенные по таймауту, незаметно переполнили бы очередь
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise RenderBusy
+        try:
+            future = executor.submit(_run_job, fn, args, metrics.enabled)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+
+        try:
+            result = future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            self.timeouts += 1
+            raise RenderTimeout
+        self.completed += 1
+        result, samples, encoded, usage = result
+        if samples:
+            metrics.merge(samples)
+        encode_stats.merge(encoded)
+        self._check_memory(executor, usage)
+        return result
+
+    def _check_memory(self, executor: ProcessPoolExecutor, usage: dict) -> None:
+        if executor is not self._executor:
+            # ответ от старого пула, который уже доделывает последние задачи
+            return
+        self._worker_memory[usage["pid"]] = (usage["rss"], usage["figures"], time.monotonic())
+        self._generation_jobs += 1
+        if self.recycle_after and self._generation_jobs >= self.recycle_after:
+            self.recycle(executor, f"выполнено {self._generation_jobs} задач")
+        # если воркер не укладывается в лимит сразу после старта, частая смена пула не поможет
+        elif (self.max_worker_rss and usage["rss"] > self.max_worker_rss
+              and self._generation_jobs >= 2 * self.workers):
+            self.recycle(executor, f"воркер {usage['pid']} занял {usage['rss'] // 2 ** 20} МБ")
+
+    def recycle(self, executor: Optional[ProcessPoolExecutor] = None, reason: str = "по запросу") -> None:
+        # новый пул принимает задачи сразу, а старый доделывает начатые и запрошенные раньше и завершается,
+        # так что ни один пользователь не теряет свой рендер
+        with self._swap_lock:
+            if self._executor is None or (executor is not None and executor is not self._executor):
+                # пул уже сменили из-за другого ответа того же поколения воркеров
+                return
+            old, self._executor = self._executor, self._make_executor()
+            self.recycles += 1
+            self._generation_jobs = 0
+            self._worker_memory.clear()
+        logger.warning("Пул рендера перезапущен: %s", reason)
+        old.shutdown(wait=False)
+        if self.warm_up != "lazy":
+            threading.Thread(target=self._ping_all, args=(self._executor,), name="render-recycle",
+                             daemon=True).start()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "ready": self.ready.is_set(),
+            "warm_up_seconds": self.warm_up_seconds,
+            "recycles": self.recycles,
+            "crashes": self.crashes,
+            **self.memory_stats(),
+        }
+
+    def memory_stats(self) -> dict:
+        # сводки старше 10 минут не учитываются: воркер мог простаивать или упасть
+        recent = time.monotonic() - 600
+        workers = [(rss, figures) for rss, figures, updated in list(self._worker_memory.values()) if updated > recent]
+        return {
+            "worker_rss_max": max((rss for rss, _ in workers), default=0),
+            "worker_rss_total": sum(rss for rss, _ in workers),
+            "worker_figures": sum(figures for _, figures in workers),
+        }
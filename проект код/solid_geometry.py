@@ -1,11 +1,26 @@
 import numpy as np
+from functools import lru_cache
 from math import sqrt
-from typing import Tuple
+from typing import NamedTuple, Tuple
 import re
 
+from config import GEOMETRY_CACHE_SIZE
+
 point = Tuple[float, float, float]
 
 
+class SectionBatch(NamedTuple):
+    points: np.ndarray
+    offsets: np.ndarray
+    valid: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def section(self, i: int) -> np.ndarray:
+        return self.points[self.offsets[i]:self.offsets[i + 1]]
+
+
 def is_correct_coordinates(s: str) -> bool:
     pattern = r'^[-+]?\d+\.\d+|[-+]?\d+$'
     parts = s.split()
@@ -86,13 +101,216 @@ class PointsConverter:
         return a, b, c, d
 
 
-class Parallelepiped:
+def canonical_plane(point_1: point, point_2: point, point_3: point, decimals: int = 9) -> Tuple[float, ...]:
+    coefficients = np.array(PointsConverter(point_1, point_2, point_3).plane_coefficients())
+    leading = coefficients[np.flatnonzero(np.abs(coefficients[:3]) > 1e-12)[0]]
+    if leading < 0:
+        coefficients = -coefficients
+    # + 0.0 убирает -0.0, чтобы одна и та же плоскость всегда давала один ключ
+    return tuple(float(x) + 0.0 for x in np.round(coefficients, decimals))
+
+
+def unique_edges(faces) -> np.ndarray:
+    edges = set()
+    for face in faces:
+        for i in range(len(face)):
+            v1, v2 = face[i], face[(i + 1) % len(face)]
+            edges.add((min(v1, v2), max(v1, v2)))
+    return np.array(sorted(edges), dtype=np.intp)
+
+
+def intersect_plane_with_edge_array(vertices: np.ndarray, edge_index: np.ndarray, coefficients,
+                                    eps: float = 1e-8) -> np.ndarray:
+    a, b, c, d = coefficients
+    distances = vertices @ np.array([a, b, c]) + d
+    on_plane = np.abs(distances) <= eps
+
+    # вершины, лежащие в плоскости, берутся как есть (и покрывают рёбра, целиком лежащие в плоскости),
+    # а рёбра учитываются только при строгой смене знака, поэтому каждая точка сечения встречается один раз
+    d1 = distances[edge_index[:, 0]]
+    d2 = distances[edge_index[:, 1]]
+    crossed = (d1 * d2 < 0) & ~on_plane[edge_index[:, 0]] & ~on_plane[edge_index[:, 1]]
+
+    p1 = vertices[edge_index[crossed, 0]]
+    p2 = vertices[edge_index[crossed, 1]]
+    t = (d1[crossed] / (d1[crossed] - d2[crossed]))[:, np.newaxis]
+
+    return np.concatenate([vertices[on_plane], p1 + t * (p2 - p1)])
+
+
+def order_section(section: np.ndarray, normal, decimals: int = 9) -> np.ndarray:
+    section = section.reshape(-1, 3)
+    _, first = np.unique(np.round(section, decimals), axis=0, return_index=True)
+    section = section[np.sort(first)]
+    if len(section) < 3:
+        return section
+
+    # сечение выпуклого многогранника выпукло, поэтому достаточно упорядочить вершины
+    # по углу вокруг центра в базисе (u, v) секущей плоскости
+    normal = np.asarray(normal, dtype=float)
+    axis = np.zeros(3)
+    axis[np.argmin(np.abs(normal))] = 1
+    u = np.cross(normal, axis)
+    u /= np.linalg.norm(u)
+    v = np.cross(normal, u)
+
+    relative = section - section.mean(axis=0)
+    angles = np.arctan2(relative @ v, relative @ u)
+    return section[np.argsort(angles, kind='stable')]
+
+
+def planes_from_points(points) -> Tuple[np.ndarray, np.ndarray]:
+    points = np.asarray(points, dtype=float).reshape(-1, 3, 3)
+    n = np.cross(points[:, 1] - points[:, 0], points[:, 2] - points[:, 0])
+    # та же проверка, что и в are_points_collinear, но сразу для всех троек точек
+    valid = ~np.all(np.abs(n) <= 1e-8, axis=1)
+    norm = np.linalg.norm(n, axis=1)
+    n = n / np.where(valid, norm, 1.0)[:, np.newaxis]
+    d = -np.einsum('ij,ij->i', n, points[:, 0])
+    return np.column_stack([n, d]), valid
+
+
+def normalize_planes(coefficients) -> Tuple[np.ndarray, np.ndarray]:
+    coefficients = np.asarray(coefficients, dtype=float).reshape(-1, 4)
+    norm = np.linalg.norm(coefficients[:, :3], axis=1)
+    valid = norm > 1e-12
+    return coefficients / np.where(valid, norm, 1.0)[:, np.newaxis], valid
+
+
+def intersect_planes_with_edge_array(vertices: np.ndarray, edge_index: np.ndarray, planes,
+                                     eps: float = 1e-8, chunk_size: int = 8192) -> SectionBatch:
+    planes = np.asarray(planes, dtype=float)
+    if planes.ndim == 3 or planes.shape[-1] != 4:
+        planes, valid = planes_from_points(planes)
+    else:
+        planes, valid = normalize_planes(planes)
+
+    v1, v2 = edge_index[:, 0], edge_index[:, 1]
+    rows_parts, points_parts = [], []
+    for start in range(0, len(planes), chunk_size):
+        chunk = planes[start:start + chunk_size]
+        distances = chunk[:, :3] @ vertices.T + chunk[:, 3:]
+        on_plane = (np.abs(distances) <= eps) & valid[start:start + chunk_size, np.newaxis]
+
+        d1 = distances[:, v1]
+        d2 = distances[:, v2]
+        crossed = (d1 * d2 < 0) & ~on_plane[:, v1] & ~on_plane[:, v2] & valid[start:start + chunk_size, np.newaxis]
+
+        vertex_rows, vertex_cols = np.nonzero(on_plane)
+        edge_rows, edge_cols = np.nonzero(crossed)
+        t1, t2 = d1[edge_rows, edge_cols], d2[edge_rows, edge_cols]
+        p1, p2 = vertices[v1[edge_cols]], vertices[v2[edge_cols]]
+        edge_points = p1 + (t1 / (t1 - t2))[:, np.newaxis] * (p2 - p1)
+
+        rows_parts += [vertex_rows + start, edge_rows + start]
+        points_parts += [vertices[vertex_cols], edge_points]
+
+    rows = np.concatenate(rows_parts) if rows_parts else np.empty(0, dtype=np.intp)
+    section_points = np.concatenate(points_parts) if points_parts else np.empty((0, 3))
+    counts = np.bincount(rows, minlength=len(planes))
+    offsets = np.zeros(len(planes) + 1, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+    return SectionBatch(section_points[order_sections(section_points, rows, planes[:, :3], counts)], offsets, valid)
+
+
+def order_sections(section_points: np.ndarray, rows: np.ndarray, normals: np.ndarray,
+                   counts: np.ndarray) -> np.ndarray:
+    # то же, что order_section, но сразу для всех плоскостей: порядок точек, при котором они сгруппированы
+    # по плоскостям и внутри группы обходят многоугольник по углу вокруг центра
+    if len(rows) == 0:
+        return np.empty(0, dtype=np.intp)
+    centers = np.column_stack([np.bincount(rows, weights=section_points[:, i], minlength=len(normals))
+                               for i in range(3)]) / np.maximum(counts, 1)[:, np.newaxis]
+    axes = np.zeros_like(normals)
+    axes[np.arange(len(normals)), np.argmin(np.abs(normals), axis=1)] = 1
+    u = np.cross(normals, axes)
+    norm = np.linalg.norm(u, axis=1)
+    # у вырожденных плоскостей нет точек сечения, деление на ноль им не нужно
+    u /= np.where(norm > 0, norm, 1.0)[:, np.newaxis]
+    v = np.cross(normals, u)
+
+    relative = section_points - centers[rows]
+    angles = np.arctan2(np.einsum('ij,ij->i', relative, v[rows]), np.einsum('ij,ij->i', relative, u[rows]))
+    return np.lexsort((angles, rows))
+
+
+class ConvexPolyhedron:
+    def __init__(self, vertices, faces):
+        self.vertices = np.asarray(vertices, dtype=float)
+        self.faces = faces
+
+        self.edge_index = unique_edges(self.faces)
+        self.edges = self.vertices[self.edge_index]
+
+        # смежность «грань - рёбра» и «ребро - две грани», по ней сечение обходится по кругу
+        edge_ids = {tuple(edge): i for i, edge in enumerate(self.edge_index.tolist())}
+        self.face_edges = []
+        self.edge_faces = np.full((len(self.edge_index), 2), -1, dtype=np.intp)
+        for f, face in enumerate(self.faces):
+            face_edges = []
+            for i in range(len(face)):
+                v1, v2 = face[i], face[(i + 1) % len(face)]
+                e = edge_ids[(min(v1, v2), max(v1, v2))]
+                face_edges.append(e)
+                self.edge_faces[e, 0 if self.edge_faces[e, 0] == -1 else 1] = f
+            self.face_edges.append(face_edges)
+
+    def get_vertices(self):
+        return self.vertices
+
+    def get_faces(self):
+        return self.faces
+
+    def intersect_plane_with_edges(self, point_1: point, point_2: point, point_3: point):
+        points_convertor = PointsConverter(point_1, point_2, point_3)
+
+        return intersect_plane_with_edge_array(self.vertices, self.edge_index,
+                                               points_convertor.plane_coefficients())
+
+    def section_polygon(self, point_1: point, point_2: point, point_3: point) -> np.ndarray:
+        points_convertor = PointsConverter(point_1, point_2, point_3)
+        return self.trace_section(points_convertor.plane_coefficients())
+
+    def trace_section(self, coefficients, eps: float = 1e-8) -> np.ndarray:
+        a, b, c, d = coefficients
+        distances = self.vertices @ np.array([a, b, c]) + d
+        if np.any(np.abs(distances) <= eps):
+            # плоскость проходит через вершину, обход по граням неоднозначен
+            section = intersect_plane_with_edge_array(self.vertices, self.edge_index, coefficients, eps)
+            return order_section(section, (a, b, c))
+
+        above = distances[self.edge_index] > 0
+        crossed = np.flatnonzero(above[:, 0] != above[:, 1])
+        if len(crossed) == 0:
+            return np.empty((0, 3))
+
+        # от первого пересечённого ребра переходим в соседнюю грань и ищем в ней второе
+        # пересечённое ребро, пока не вернёмся к началу: обрабатываются только k рёбер сечения
+        start = edge = crossed[0]
+        face = self.edge_faces[edge, 0]
+        section = []
+        while True:
+            v1, v2 = self.edge_index[edge]
+            t = distances[v1] / (distances[v1] - distances[v2])
+            section.append(self.vertices[v1] + t * (self.vertices[v2] - self.vertices[v1]))
+            edge = next(e for e in self.face_edges[face]
+                        if e != edge and above[e, 0] != above[e, 1])
+            if edge == start:
+                break
+            face = self.edge_faces[edge, 1] if self.edge_faces[edge, 0] == face else self.edge_faces[edge, 0]
+        return np.array(section)
+
+    def intersect_planes_with_edges(self, planes) -> SectionBatch:
+        return intersect_planes_with_edge_array(self.vertices, self.edge_index, planes)
+
+
+class Parallelepiped(ConvexPolyhedron):
     def __init__(self, length: float, width: float, height: float):
         self.length = length
         self.width = width
         self.height = height
 
-        self.vertices = np.array([
+        super().__init__([
             [0, 0, 0],
             [length, 0, 0],
             [length, width, 0],
@@ -101,90 +319,133 @@ class Parallelepiped:
             [length, 0, height],
             [length, width, height],
             [0, width, height]
-        ])
-
-        self.faces = [
+        ], [
             [0, 1, 2, 3],
             [4, 5, 6, 7],
             [0, 1, 5, 4],
             [1, 2, 6, 5],
             [2, 3, 7, 6],
             [3, 0, 4, 7]
-        ]
+        ])
 
-    def get_vertices(self):
-        return self.vertices
 
-    def get_faces(self):
-        return self.faces
+class Tetrahedron(ConvexPolyhedron):
+    def __init__(self, coefficient: float):
+        self.coefficient = coefficient
 
-    def intersect_plane_with_edges(self, point_1: point, point_2: point, point_3: point):
-        section_vertices = []
+        super().__init__([
+            [0, 0, 0],
+            [coefficient, 0, 0],
+            [coefficient / 2, sqrt(3) * coefficient / 2, 0],
+            [coefficient / 2, sqrt(3) * coefficient / 5, sqrt(3) * coefficient / 2]
+        ], [
+            [0, 1, 2],
+            [1, 2, 3],
+            [2, 0, 3],
+            [0, 1, 3]
+        ])
 
-        points_convertor = PointsConverter(point_1, point_2, point_3)
 
-        a, b, c, d = points_convertor.plane_coefficients()
+class Octahedron(ConvexPolyhedron):
+    def __init__(self, edge: float):
+        self.edge = edge
 
-        for face in self.faces:
-            v1, v2, v3, v4 = self.vertices[face]
+        r = edge / sqrt(2)
+        super().__init__([
+            [r, r, 0],
+            [2 * r, r, r],
+            [r, 2 * r, r],
+            [0, r, r],
+            [r, 0, r],
+            [r, r, 2 * r]
+        ], [
+            [0, 1, 2],
+            [0, 2, 3],
+            [0, 3, 4],
+            [0, 4, 1],
+            [5, 2, 1],
+            [5, 3, 2],
+            [5, 4, 3],
+            [5, 1, 4]
+        ])
 
-            edges = [(v1, v2), (v2, v3), (v3, v4), (v4, v1)]
 
-            for edge in edges:
-                p1, p2 = edge
-                denom = a * (p2[0] - p1[0]) + b * (p2[1] - p1[1]) + c * (p2[2] - p1[2])
-                if abs(denom) > 1e-8:
-                    t = -(a * p1[0] + b * p1[1] + c * p1[2] + d) / denom
-                    if 0 <= t <= 1:
-                        intersection = p1 + t * (p2 - p1)
-                        section_vertices.append(intersection)
+class Pyramid(ConvexPolyhedron):
+    def __init__(self, side: float, height: float):
+        self.side = side
+        self.height = height
 
-        return np.array(section_vertices)
+        super().__init__([
+            [0, 0, 0],
+            [side, 0, 0],
+            [side, side, 0],
+            [0, side, 0],
+            [side / 2, side / 2, height]
+        ], [
+            [0, 1, 2, 3],
+            [0, 1, 4],
+            [1, 2, 4],
+            [2, 3, 4],
+            [3, 0, 4]
+        ])
 
 
-class Tetrahedron:
-    def __init__(self, coefficient: float):
-        self.coefficient = coefficient
+class Prism(ConvexPolyhedron):
+    def __init__(self, side: float, height: float):
+        self.side = side
+        self.height = height
 
-        self.vertices = np.array([
+        super().__init__([
             [0, 0, 0],
-            [coefficient, 0, 0],
-            [coefficient / 2, sqrt(3) * coefficient / 2, 0],
-            [coefficient / 2, sqrt(3) * coefficient / 5, sqrt(3) * coefficient / 2]
+            [side, 0, 0],
+            [side / 2, sqrt(3) * side / 2, 0],
+            [0, 0, height],
+            [side, 0, height],
+            [side / 2, sqrt(3) * side / 2, height]
+        ], [
+            [0, 1, 2],
+            [3, 4, 5],
+            [0, 1, 4, 3],
+            [1, 2, 5, 4],
+            [2, 0, 3, 5]
         ])
 
-        self.faces = [
-            [0, 1, 2],
-            [1, 2, 3],
-            [2, 0, 3],
-            [0, 1, 3]
-        ]
 
-    def get_vertices(self):
-        return self.vertices
+solid_types = {
+    "tetrahedron": Tetrahedron,
+    "parallelepiped": Parallelepiped,
+    "octahedron": Octahedron,
+    "pyramid": Pyramid,
+    "prism": Prism,
+}
 
-    def get_faces(self):
-        return self.faces
 
-    def intersect_plane_with_edges(self, point_1: point, point_2: point, point_3: point):
-        section_vertices = []
+@lru_cache(maxsize=256)
+def make_solid(kind: str, dimensions: Tuple[float, ...]) -> ConvexPolyhedron:
+    return solid_types[kind](*dimensions)
 
-        points_convertor = PointsConverter(point_1, point_2, point_3)
 
-        a, b, c, d = points_convertor.plane_coefficients()
+@lru_cache(maxsize=GEOMETRY_CACHE_SIZE)
+def plane_section(kind: str, dimensions: Tuple[float, ...], plane: Tuple[float, ...]) -> np.ndarray:
+    section = make_solid(kind, dimensions).trace_section(plane)
+    # один массив отдаётся всем пользователям, поэтому запрещаем его менять
+    section.setflags(write=False)
+    return section
 
-        for face in self.faces:
-            v1, v2, v3, = self.vertices[face]
 
-            edges = [(v1, v2), (v2, v3), (v3, v1)]
+def cached_section(kind: str, dimensions: Tuple[float, ...],
+                   point_1: point, point_2: point, point_3: point) -> np.ndarray:
+    # разные тройки точек одной плоскости дают одну каноническую плоскость и одну запись в кэше
+    return plane_section(kind, tuple(map(float, dimensions)), canonical_plane(point_1, point_2, point_3))
 
-            for edge in edges:
-                p1, p2 = edge
-                denom = a * (p2[0] - p1[0]) + b * (p2[1] - p1[1]) + c * (p2[2] - p1[2])
-                if abs(denom) > 1e-8:
-                    t = -(a * p1[0] + b * p1[1] + c * p1[2] + d) / denom
-                    if 0 <= t <= 1:
-                        intersection = p1 + t * (p2 - p1)
-                        section_vertices.append(intersection)
 
-        return np.array(section_vertices)
+def geometry_cache_stats() -> dict:
+    info = plane_section.cache_info()
+    requests = info.hits + info.misses
+    return {
+        "entries": info.currsize,
+        "max_entries": info.maxsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_rate": info.hits / requests if requests else 0.0,
+    }
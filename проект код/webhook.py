@@ -0,0 +1,120 @@
+import asyncio
+import hmac
+import logging
+import signal
+from typing import List, Optional, Set
+
+from aiohttp import web
+from telebot import types
+from telebot.async_telebot import AsyncTeleBot
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    def __init__(self, bot: AsyncTeleBot, path: str, secret_token: Optional[str],
+                 batch_size: int = 100, queue_size: int = 10000, drain_timeout: float = 30):
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.batch_size = batch_size
+        self.drain_timeout = drain_timeout
+        self.received = 0
+        self.rejected = 0
+        self.batches = 0
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._batches: Set[asyncio.Task] = set()
+        self._processor: Optional[asyncio.Task] = None
+        self._accepting = False
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.on_startup.append(self._on_startup)
+        app.on_shutdown.append(self._on_shutdown)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token is not None:
+            token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(token, self.secret_token):
+                self.rejected += 1
+                return web.Response(status=403)
+        if not self._accepting:
+            # Telegram повторит доставку, если ответить ошибкой, так что при остановке апдейт не потеряется
+            return web.Response(status=503)
+        try:
+            update = types.Update.de_json(await request.text())
+        except (ValueError, KeyError, TypeError):
+            # корректный JSON, который не является апдейтом, тоже ошибка клиента, а не 500
+            self.rejected += 1
+            return web.Response(status=400)
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response()
+
+    async def _process(self) -> None:
+        while True:
+            batch: List[types.Update] = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            self.batches += 1
+            task = asyncio.create_task(self._process_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _process_batch(self, batch: List[types.Update]) -> None:
+        try:
+            await self.bot.process_new_updates(batch)
+        except Exception:
+            logger.exception("Ошибка при обработке пачки апдейтов")
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _on_startup(self, app: web.Application) -> None:
+        self._accepting = True
+        self._processor = asyncio.create_task(self._process())
+
+    async def _on_shutdown(self, app: web.Application) -> None:
+        await self.drain()
+
+    async def drain(self) -> None:
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Не дождались обработки %d апдейтов", self._queue.qsize())
+        if self._processor is not None:
+            self._processor.cancel()
+            self._processor = None
+        if self._batches:
+            await asyncio.wait(self._batches, timeout=self.drain_timeout)
+
+
+async def run_webhook(bot: AsyncTeleBot, url: Optional[str], path: str, secret_token: Optional[str],
+                      host: str, port: int, batch_size: int = 100, stop: Optional[asyncio.Event] = None) -> None:
+    server = WebhookServer(bot, path, secret_token, batch_size)
+    runner = web.AppRunner(server.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signal_number, stop.set)
+        except NotImplementedError:
+            pass
+    try:
+        if url:
+            await bot.set_webhook(url=url, secret_token=secret_token)
+        logger.info("Webhook слушает %s:%d%s", host, port, path)
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await bot.close_session()
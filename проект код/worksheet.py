@@ -0,0 +1,265 @@
+import argparse
+import csv
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, NamedTuple, Tuple, Union
+
+from config import RENDER_START_METHOD
+from solid_geometry import are_points_collinear, solid_types
+
+# Пакетная генерация сечений для печатных листов заданий, без Telegram:
+#   python worksheet.py problems.jsonl -o out/
+# Строка JSONL: {"id": "1a", "solid": "parallelepiped", "dimensions": [3, 2, 1],
+#                "points": [[0, 0, 0.5], [1, 0, 0.7], [0, 1, 0.9]]}
+# CSV с заголовком id,solid,dimensions,point_1,point_2,point_3, числа внутри поля через пробел.
+# Картинки и manifest.jsonl пишутся в выходной каталог по мере готовности; повторный запуск
+# с тем же входом пропускает уже записанные в манифест задачи, а с другим входом в тот же каталог - отказывается.
+
+manifest_name = "manifest.jsonl"
+# хэш входного файла: манифест хранит номера строк, и продолжать можно только тот же вход
+source_name = "source.json"
+
+
+class Problem(NamedTuple):
+    row: int
+    id: str
+    kind: str
+    dimensions: Tuple[float, ...]
+    points: Tuple[list, list, list]
+
+
+class InvalidProblem(NamedTuple):
+    row: int
+    id: str
+    error: str
+
+
+def numbers(value, count: int, what: str) -> list:
+    if isinstance(value, (int, float)):
+        value = [value]
+    values = value.split() if isinstance(value, str) else list(value)
+    if count and len(values) != count:
+        raise ValueError(f"{what}: нужно {count} числа, указано {len(values)}")
+    try:
+        return [float(v) for v in values]
+    except (TypeError, ValueError):
+        raise ValueError(f"{what}: «{value}» - не числа")
+
+
+def parse_problem(row: int, record: dict) -> Union[Problem, InvalidProblem]:
+    problem_id = str(record.get("id") or f"{row:06d}")
+    try:
+        kind = str(record.get("solid", "")).strip().lower()
+        if kind not in solid_types:
+            raise ValueError(f"неизвестная фигура «{kind}», доступны: {', '.join(solid_types)}")
+        # число размеров берётся из конструктора фигуры, чтобы ошибка была в манифесте, а не в воркере
+        names = list(inspect.signature(solid_types[kind]).parameters)
+        dimensions = tuple(numbers(record.get("dimensions", ""), len(names), f"размеры ({', '.join(names)})"))
+        if not dimensions or min(dimensions) <= 0:
+            raise ValueError("размеры должны быть числами больше 0")
+        raw_points = record.get("points") or [record.get(f"point_{i}", "") for i in (1, 2, 3)]
+        if len(raw_points) != 3:
+            raise ValueError(f"нужно 3 точки, указано {len(raw_points)}")
+        points = []
+        for i, raw in enumerate(raw_points, 1):
+            x, y, z = numbers(raw, 3, f"точка {i}")
+            # координаты вводятся как в боте (X Y Z), а фигуры построены в осях (Y, X, Z), см. parse_point
+            points.append([y, x, z])
+        if are_points_collinear(*points):
+            raise ValueError("точки лежат на одной прямой")
+    except ValueError as e:
+        return InvalidProblem(row, problem_id, str(e))
+    return Problem(row, problem_id, kind, dimensions, tuple(points))
+
+
+def read_problems(path: str) -> Iterator[Union[Problem, InvalidProblem]]:
+    # файл читается построчно, в памяти нет ничего, кроме текущей строки
+    with open(path, encoding="utf-8", newline="") as file:
+        if path.lower().endswith(".csv"):
+            for row, record in enumerate(csv.DictReader(file), 1):
+                yield parse_problem(row, record)
+            return
+        for row, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield InvalidProblem(row, f"{row:06d}", f"некорректный JSON: {e}")
+                continue
+            yield parse_problem(row, record)
+
+
+def safe_name(problem_id: str) -> str:
+    return re.sub(r"[^\w.-]", "_", problem_id)[:100] or "problem"
+
+
+def render_problem(problem: Problem, directory: str) -> dict:
+    # картинка пишется в файл прямо в воркере, в родителя возвращается только строка манифеста
+    from figure_builder import draw_section, section_message
+    from image_encoding import file_name
+    from solid_geometry import cached_section
+
+    start = time.perf_counter()
+    try:
+        section = cached_section(problem.kind, problem.dimensions, *problem.points)
+        photo = draw_section(problem.kind, problem.dimensions, section)
+    except Exception as e:
+        return {"row": problem.row, "id": problem.id, "status": "error", "error": f"{type(e).__name__}: {e}"}
+    stem = safe_name(problem.id)
+    temp_path = os.path.join(directory, f"{stem}.{problem.row}.tmp")
+    with open(temp_path, "wb") as file:
+        file.write(photo)
+    # после прерывания в каталоге не остаётся недописанных картинок; link, в отличие от replace,
+    # не перезаписывает чужой файл: одинаковые id или id, совпавшие после замены символов,
+    # получают номер строки в имени
+    name = file_name(photo, stem)
+    try:
+        os.link(temp_path, os.path.join(directory, name))
+    except FileExistsError:
+        name = file_name(photo, f"{stem}_{problem.row}")
+        os.replace(temp_path, os.path.join(directory, name))
+    else:
+        os.unlink(temp_path)
+    return {"row": problem.row, "id": problem.id, "status": "ok", "file": name, "bytes": len(photo),
+            "message": section_message(section), "seconds": round(time.perf_counter() - start, 3)}
+
+
+class Progress:
+    # номера строк уже записанных задач хранятся битами: миллион задач - 125 КБ
+    def __init__(self):
+        self.bits = bytearray()
+
+    def add(self, row: int) -> None:
+        index, bit = divmod(row, 8)
+        if index >= len(self.bits):
+            self.bits.extend(bytes(index - len(self.bits) + 1))
+        self.bits[index] |= 1 << bit
+
+    def __contains__(self, row: int) -> bool:
+        index, bit = divmod(row, 8)
+        return index < len(self.bits) and bool(self.bits[index] & (1 << bit))
+
+
+def load_progress(manifest_path: str, retry_errors: bool) -> Progress:
+    progress = Progress()
+    if not os.path.exists(manifest_path):
+        return progress
+    with open(manifest_path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # оборванная последняя строка после аварийной остановки
+                continue
+            if entry.get("status") == "ok" or not retry_errors:
+                progress.add(entry["row"])
+    return progress
+
+
+def input_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def check_source(directory: str, manifest_path: str, input_path: str) -> bool:
+    source_path = os.path.join(directory, source_name)
+    source = {"input": os.path.abspath(input_path), "sha256": input_digest(input_path)}
+    if os.path.exists(manifest_path):
+        try:
+            with open(source_path, encoding="utf-8") as file:
+                previous = json.load(file)
+        except (OSError, ValueError):
+            previous = {}
+        if previous.get("sha256") != source["sha256"]:
+            print(f"В {directory} уже есть результаты для другого входного файла "
+                  f"({previous.get('input', 'неизвестного')}) - укажите другой каталог", file=sys.stderr)
+            return False
+    with open(source_path, "w", encoding="utf-8") as file:
+        json.dump(source, file, ensure_ascii=False)
+    return True
+
+
+def run(input_path: str, directory: str, workers: int, window: int, retry_errors: bool) -> int:
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, manifest_name)
+    if not check_source(directory, manifest_path, input_path):
+        return 2
+    progress = load_progress(manifest_path, retry_errors)
+
+    context = multiprocessing.get_context(RENDER_START_METHOD)
+    if RENDER_START_METHOD == "forkserver":
+        context.set_forkserver_preload(["figure_builder", "matplotlib.figure", "matplotlib.backends.backend_agg",
+                                        "mpl_toolkits.mplot3d"])
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+    started = time.perf_counter()
+
+    with open(manifest_path, "a", encoding="utf-8") as manifest, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        def record(entry: dict) -> None:
+            manifest.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            manifest.flush()
+            counts[entry["status"]] += 1
+            if entry["status"] == "error":
+                print(f"строка {entry['row']} ({entry['id']}): {entry['error']}", file=sys.stderr)
+            done = counts["ok"] + counts["error"]
+            if done % 50 == 0:
+                print(f"готово {done}, {done / (time.perf_counter() - started):.1f}/с", file=sys.stderr)
+
+        # в работе не больше window задач, так что память не зависит от размера входа
+        pending = set()
+        try:
+            for problem in read_problems(input_path):
+                if problem.row in progress:
+                    counts["skipped"] += 1
+                    continue
+                if isinstance(problem, InvalidProblem):
+                    record({"row": problem.row, "id": problem.id, "status": "error", "error": problem.error})
+                    continue
+                if len(pending) >= window:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        record(future.result())
+                pending.add(executor.submit(render_problem, problem, directory))
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record(future.result())
+        except (KeyboardInterrupt, BrokenProcessPool) as e:
+            for future in pending:
+                if not future.cancel() and future.done() and future.exception() is None:
+                    record(future.result())
+            print("Остановлено" if isinstance(e, KeyboardInterrupt) else "Воркер рендера упал",
+                  "- запустите ту же команду ещё раз, чтобы продолжить", file=sys.stderr)
+            return 130 if isinstance(e, KeyboardInterrupt) else 1
+
+    elapsed = time.perf_counter() - started
+    print(f"Готово: {counts['ok']}, с ошибками: {counts['error']}, пропущено как уже готовые: {counts['skipped']} "
+          f"за {elapsed:.1f} с. Манифест: {manifest_path}", file=sys.stderr)
+    return 1 if counts["error"] else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Сечения для листов заданий из JSONL или CSV")
+    parser.add_argument("input", help="файл задач: .jsonl или .csv")
+    parser.add_argument("-o", "--output", default="worksheet", help="каталог для картинок и manifest.jsonl")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--window", type=int, help="сколько задач одновременно в работе, по умолчанию 4 на воркер")
+    parser.add_argument("--retry-errors", action="store_true", help="при продолжении заново считать задачи с ошибками")
+    args = parser.parse_args()
+    return run(args.input, args.output, args.workers, args.window or 4 * args.workers, args.retry_errors)
+
+
+if __name__ == "__main__":
+    sys.exit(main())